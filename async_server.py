@@ -0,0 +1,108 @@
+import os
+import sys
+import math
+import time
+import asyncio
+from aiohttp import web, ClientSession, FormData
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+# Production serving on aiohttp (already installed for the async bot). The hot routes
+# are native handlers that stream request bodies; every other route falls through
+# to the Flask app, run in a worker thread so it never blocks the server loop.
+SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 5000))
+STREAM_BLOCK_SIZE = 256 * 1024  # Bytes read from a request body at a time
+
+# aiohttp handler that serves a request through a WSGI app
+def wsgi_fallback(wsgi_app):
+    async def handle(request):
+        environ = EnvironBuilder(
+            path=request.path, method=request.method, query_string=request.query_string,
+            headers=list(request.headers.items()), data=await request.read()
+        ).get_environ()
+        environ['REMOTE_ADDR'] = request.remote or ''
+        app_iter, status, headers = await asyncio.to_thread(run_wsgi_app, wsgi_app, environ, True)
+        return web.Response(body=b''.join(app_iter), status=int(status.split(' ', 1)[0]),
+                            headers=[(key, value) for key, value in headers if key.lower() != 'content-length'])
+    return handle
+
+# Stream a request body part to write(block, offset) as it arrives and return its
+# size. A part that grows past limit is not written beyond it; the size returned
+# is then larger than limit.
+async def stream_part(part, write, limit=None):
+    size = 0
+    while True:
+        block = await part.read_chunk(STREAM_BLOCK_SIZE)
+        if not block:
+            return size
+        if limit is not None and size + len(block) > limit:
+            return size + len(block)
+        await asyncio.to_thread(write, block, size)
+        size += len(block)
+
+# Stream a raw request body to write(block, offset) as it arrives; returns its size
+async def stream_body(request, write):
+    size = 0
+    async for block in request.content.iter_chunked(STREAM_BLOCK_SIZE):
+        await asyncio.to_thread(write, block, size)
+        size += len(block)
+    return size
+
+# routes: [(method, path, handler)], served natively; the rest go to wsgi_app
+def run_async_server(routes, wsgi_app, max_body_size):
+    app = web.Application(client_max_size=max_body_size)
+    for method, path, handler in routes:
+        app.router.add_route(method, path, handler)
+    app.router.add_route('*', '/{tail:.*}', wsgi_fallback(wsgi_app))
+    web.run_app(app, host=SERVER_HOST, port=SERVER_PORT)
+
+# Requests per second of /job_status polling, then upload MB/s of parallel chunk
+# posts to one preallocated upload, which is cancelled afterwards so no file is left
+# in the server's upload folder.
+async def benchmark_server(base_url, seconds=10, concurrency=32, upload_mb=256, chunk_mb=5):
+    async with ClientSession() as session:
+        requests_done = 0
+        deadline = time.time() + seconds
+
+        async def poll():
+            nonlocal requests_done
+            while time.time() < deadline:
+                async with session.get(f'{base_url}/job_status', params={'job_id': 'benchmark'}) as response:
+                    await response.read()
+                requests_done += 1
+
+        await asyncio.gather(*(poll() for _ in range(concurrency)))
+        print(f"/job_status: {requests_done / seconds:.0f} requests/s with {concurrency} clients")
+
+        chunk_size = chunk_mb * 1024 * 1024
+        total_size = upload_mb * 1024 * 1024
+        async with session.post(f'{base_url}/init_upload',
+                                data={'total_size': str(total_size), 'chunk_size': str(chunk_size)}) as response:
+            upload_id = (await response.json())['upload_id']
+
+        pending = list(range(math.ceil(total_size / chunk_size)))
+
+        async def upload():
+            while pending:
+                chunk_index = pending.pop(0)
+                form = FormData()
+                form.add_field('upload_id', upload_id)
+                form.add_field('chunk_index', str(chunk_index))
+                form.add_field('chunk', bytes(min(chunk_size, total_size - chunk_index * chunk_size)),
+                               filename='blob', content_type='application/octet-stream')
+                async with session.post(f'{base_url}/upload_chunk', data=form) as response:
+                    response.raise_for_status()
+
+        started = time.time()
+        try:
+            await asyncio.gather(*(upload() for _ in range(4)))
+            elapsed = time.time() - started
+        finally:
+            async with session.post(f'{base_url}/cancel_upload', data={'upload_id': upload_id}) as response:
+                await response.read()
+        print(f"/upload_chunk: {total_size / 1024 ** 2 / elapsed:.1f} MB/s with 4 parallel uploads")
+
+if __name__ == '__main__':
+    if '--benchmark' in sys.argv:
+        urls = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+        asyncio.run(benchmark_server(urls[0] if urls else f'http://127.0.0.1:{SERVER_PORT}'))
@@ -1,8 +1,12 @@
 import os
-import subprocess
 import time
 import math
-import json
+import functools
+from ffmpeg_encoders import select_encoders, run_with_encoder_fallback
+from encoding_profiles import profile_video_args
+from title_overlays import render_title_frame, build_overlay_filter
+from media_probe import probe_media
+from ffmpeg_progress import run_with_progress
 
 # Start total timer
 total_start_time = time.time()
@@ -17,40 +21,12 @@ output_folder = "input_cut"
 if not os.path.exists(output_folder):
     os.makedirs(output_folder)
 
-# Get video information using ffprobe
-def get_video_info(video_path):
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-select_streams', 'v:0',
-        '-show_entries', 'stream=duration,r_frame_rate,width,height',
-        '-show_entries', 'format=duration',
-        '-of', 'json',
-        video_path
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    info = json.loads(result.stdout)
-
-    # Extract video stream info
-    video_stream = info['streams'][0]
-    fps = eval(video_stream['r_frame_rate'])
-    width = int(video_stream['width'])
-    height = int(video_stream['height'])
-    duration = float(info['format']['duration'])
-
-    return {
-        'duration': duration,
-        'fps': fps,
-        'width': width,
-        'height': height
-    }
-
-# Get video info
-video_info = get_video_info(input_video)
-duration = video_info['duration']
-fps = video_info['fps']
-width = video_info['width']
-height = video_info['height']
+# Get video info (cached per file, shared with verify.py)
+video_info = probe_media(input_video)
+duration = video_info.duration
+fps = video_info.fps
+width = video_info.width
+height = video_info.height
 
 print(f"Video info: {width}x{height}, {fps:.2f} fps, {duration:.2f} seconds")
 
@@ -83,6 +59,11 @@ if not font_path:
     print("Warning: No suitable font found. Using default font.")
     font_path = "arial"  # FFmpeg will use default
 
+# Pick the fastest working encoder; hosts without NVENC fall back down the list
+encoders = select_encoders()
+encoding_profile = os.environ.get('ENCODING_PROFILE', 'fast')
+print(f"Encoders (in order of preference): {', '.join(encoders)} | Profile: {encoding_profile}")
+
 # Process each part using FFmpeg with frame-accurate cutting
 for i in range(num_parts):
     part_start_time = time.time()
@@ -99,18 +80,19 @@ for i in range(num_parts):
     # Output filename
     output_path = os.path.join(output_folder, f"part_{i+1}.mp4")
 
+    # White bars with the part label, rendered once and reused across runs
+    title_frame = render_title_frame(f'Part {i+1}', font_path, target_width, target_height, style='light')
+
     # FFmpeg command with frame-accurate cutting using keyframes
-    cmd = [
+    cmd = lambda encoder: [
         'ffmpeg',
         '-ss', str(start_time),
         '-i', input_video,
+        '-loop', '1', '-i', title_frame,
         '-t', str(part_duration_actual),
-        '-vf',
-        f'scale={target_width}:{middle_height}:force_original_aspect_ratio=decrease,pad={target_width}:{middle_height}:(ow-iw)/2:(oh-ih)/2:color=white,pad={target_width}:{target_height}:0:{top_bar_height}:color=white,drawtext=text=\'Part {i+1}\':fontfile={font_path}:fontsize=80:x=(w-tw)/2:y=(h-th)/10:fontcolor=black:shadowcolor=gray:shadowx=3:shadowy=3',
-        '-c:v', 'h264_nvenc',  # NVIDIA GPU encoding
-        '-preset', 'fast',
-        '-rc', 'vbr',  # Variable bitrate
-        '-cq', '20',    # Quality level (lower = better quality)
+        '-filter_complex', build_overlay_filter(target_width, top_bar_height, middle_height, 'light'),
+        '-map', '[v]', '-map', '0:a:0?',
+        *profile_video_args(encoding_profile, encoder),  # GPU encoding when available
         '-c:a', 'aac',
         '-b:a', '192k',
         '-movflags', '+faststart',
@@ -120,19 +102,11 @@ for i in range(num_parts):
         output_path
     ]
 
-    # Run FFmpeg
-    subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-
-    # Verify output duration
-    verify_cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        output_path
-    ]
-    result = subprocess.run(verify_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    output_duration = float(result.stdout.strip())
+    # Run FFmpeg, retrying on the next encoder if this one fails.
+    # Output duration, frames and speed come from ffmpeg's progress reports
+    progress = {}
+    run_with_encoder_fallback(cmd, encoders, run=functools.partial(run_with_progress, progress=progress))
+    output_duration = progress.get('duration', 0.0)
 
     # Calculate and print part execution time
     part_end_time = time.time()
@@ -149,17 +123,15 @@ for i in range(num_parts):
             print(f"Recreating {output_path} with more accurate method...")
 
             # Use keyframe alignment for more accurate cutting
-            cmd_accurate = [
+            cmd_accurate = lambda encoder: [
                 'ffmpeg',
                 '-ss', str(start_time),
                 '-i', input_video,
+                '-loop', '1', '-i', title_frame,
                 '-to', str(end_time),
-                '-vf',
-                f'scale={target_width}:{middle_height}:force_original_aspect_ratio=decrease,pad={target_width}:{middle_height}:(ow-iw)/2:(oh-ih)/2:color=white,pad={target_width}:{target_height}:0:{top_bar_height}:color=white,drawtext=text=\'Part {i+1}\':fontfile={font_path}:fontsize=80:x=(w-tw)/2:y=(h-th)/10:fontcolor=black:shadowcolor=gray:shadowx=3:shadowy=3',
-                '-c:v', 'h264_nvenc',  # NVIDIA GPU encoding
-                '-preset', 'fast',
-                '-rc', 'vbr',  # Variable bitrate
-                '-cq', '20',    # Quality level (lower = better quality)
+                '-filter_complex', build_overlay_filter(target_width, top_bar_height, middle_height, 'light'),
+                '-map', '[v]', '-map', '0:a:0?',
+                *profile_video_args(encoding_profile, encoder),  # GPU encoding when available
                 '-c:a', 'aac',
                 '-b:a', '192k',
                 '-movflags', '+faststart',
@@ -170,14 +142,12 @@ for i in range(num_parts):
             ]
 
             # Run accurate FFmpeg command
-            subprocess.run(cmd_accurate, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-
-            # Verify again
-            result = subprocess.run(verify_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            output_duration = float(result.stdout.strip())
+            run_with_encoder_fallback(cmd_accurate, encoders, run=functools.partial(run_with_progress, progress=progress))
+            output_duration = progress.get('duration', 0.0)
             print(f"Recreated: {output_path} | New duration: {output_duration:.2f}s")
 
-    print(f"Created: {output_path} | Time taken: {part_time:.2f}s | Duration: {output_duration:.2f}s")
+    print(f"Created: {output_path} | Time taken: {part_time:.2f}s | Duration: {output_duration:.2f}s | "
+          f"Frames: {progress.get('frames', 0)} | Speed: {progress.get('speed', 0):.2f}x")
 
 # Calculate and print total execution time
 total_end_time = time.time()
@@ -189,8 +159,10 @@ print(f"Average time per part: {total_time/num_parts:.2f} seconds")
 # Create a verification script to check all parts
 with open(os.path.join(output_folder, 'verify.py'), 'w') as f:
     f.write(f"""
-import subprocess
 import os
+import sys
+sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+from media_probe import probe_media
 
 # Check all parts
 parts = {num_parts}
@@ -201,17 +173,9 @@ for i in range(1, parts+1):
         print(f"ERROR: Part {{i}} does not exist!")
         continue
 
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        output_path
-    ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    duration = float(result.stdout.strip())
-    total_duration += duration
-    print(f"Part {{i}}: {{duration:.2f}} seconds")
+    part_duration = probe_media(output_path).duration
+    total_duration += part_duration
+    print(f"Part {{i}}: {{part_duration:.2f}} seconds")
 
 print(f"\\nTotal duration of all parts: {{total_duration:.2f}} seconds")
 print(f"Original video duration: {duration:.2f} seconds")
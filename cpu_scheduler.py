@@ -0,0 +1,65 @@
+import os
+import time
+import shutil
+import threading
+import subprocess
+from collections import deque
+from contextlib import contextmanager
+
+# Cores this process may use (respects taskset/cgroup pinning where the OS exposes it)
+if hasattr(os, 'sched_getaffinity'):
+    AVAILABLE_CORES = sorted(os.sched_getaffinity(0))
+else:
+    AVAILABLE_CORES = list(range(os.cpu_count() or 1))
+
+# Global budget shared by every ffmpeg this process starts; CPU_AFFINITY=1 also pins
+# each process to the cores it was granted. Pinning goes through taskset rather than a
+# preexec_fn, which isn't safe to run between fork and exec in a threaded process.
+CPU_BUDGET = max(1, min(int(os.environ.get('CPU_BUDGET', len(AVAILABLE_CORES))), len(AVAILABLE_CORES)))
+CPU_AFFINITY = os.environ.get('CPU_AFFINITY', '0') == '1' and shutil.which('taskset') is not None
+
+_condition = threading.Condition()
+_free_cores = list(AVAILABLE_CORES[:CPU_BUDGET])
+_waiting = deque()
+
+# Block until `count` cores are free, first come first served, and hold them for the block
+@contextmanager
+def reserve_cores(count):
+    count = max(1, min(count, CPU_BUDGET))
+    ticket = object()
+    with _condition:
+        _waiting.append(ticket)
+        while _waiting[0] is not ticket or len(_free_cores) < count:
+            _condition.wait()
+        _waiting.popleft()
+        cores = [_free_cores.pop(0) for _ in range(count)]
+        _condition.notify_all()
+    try:
+        yield cores
+    finally:
+        with _condition:
+            _free_cores.extend(cores)
+            _free_cores.sort()
+            _condition.notify_all()
+
+# subprocess.run under the budget. The caller passes the same thread count to ffmpeg,
+# for the encoder (-threads as an output option) and for decoding and filtering
+# (ffmpeg_thread_args), so the process really stays within the cores it holds.
+def run_scheduled(cmd, threads=1, **run_kwargs):
+    with reserve_cores(threads) as cores:
+        if CPU_AFFINITY:
+            cmd = ['taskset', '-c', ','.join(map(str, cores))] + list(cmd)
+        # elapsed is the run time alone, excluding the wait for cores
+        started = time.time()
+        result = subprocess.run(cmd, **run_kwargs)
+        result.elapsed = time.time() - started
+        return result
+
+# Thread limits for an ffmpeg's decoder and filter graphs, placed before its main -i.
+# -threads there applies to that input only; the filter options are global.
+def ffmpeg_thread_args(threads):
+    return ['-filter_threads', str(threads), '-filter_complex_threads', str(threads), '-threads', str(threads)]
+
+def budget_status():
+    with _condition:
+        return {'budget': CPU_BUDGET, 'free': len(_free_cores), 'queued': len(_waiting), 'affinity': CPU_AFFINITY}
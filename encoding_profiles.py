@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import subprocess
+from ffmpeg_encoders import ENCODER_CACHE_DIR, select_encoders
+
+# Named encoding profiles, fastest first. Each lists the video arguments per encoder;
+# encoders without an entry fall back to the profile's libx264 settings.
+PROFILES = {
+    'draft': {
+        'description': 'Quick previews, lowest CPU cost',
+        'libx264': ['-preset', 'veryfast', '-crf', '23'],
+        'h264_nvenc': ['-preset', 'fast', '-rc', 'vbr', '-cq', '26'],
+        'h264_qsv': ['-preset', 'veryfast', '-global_quality', '26'],
+        'h264_videotoolbox': ['-q:v', '50']
+    },
+    'fast': {
+        'description': 'Good quality at GPU speed (console_convert.py defaults)',
+        'libx264': ['-preset', 'fast', '-crf', '20'],
+        'h264_nvenc': ['-preset', 'fast', '-rc', 'vbr', '-cq', '20'],
+        'h264_qsv': ['-preset', 'fast', '-global_quality', '20'],
+        'h264_videotoolbox': ['-q:v', '65']
+    },
+    'balanced': {
+        'description': 'Visually lossless, moderate CPU cost',
+        'libx264': ['-preset', 'slow', '-crf', '18'],
+        'h264_nvenc': ['-preset', 'slow', '-rc', 'vbr', '-cq', '18'],
+        'h264_qsv': ['-preset', 'slow', '-global_quality', '18'],
+        'h264_videotoolbox': ['-q:v', '70']
+    },
+    'film': {
+        'description': 'Film-tuned x264, slow',
+        'libx264': ['-preset', 'veryslow', '-crf', '16', '-tune', 'film',
+                    '-x264-params', 'ref=6:me=umh:subq=9:trellis=2:8x8dct=1'],
+        'h264_nvenc': ['-preset', 'slow', '-rc', 'vbr', '-cq', '16'],
+        'h264_qsv': ['-preset', 'slow', '-global_quality', '16'],
+        'h264_videotoolbox': ['-q:v', '75']
+    },
+    'archive': {
+        'description': 'Highest quality, slowest',
+        'libx264': ['-preset', 'veryslow', '-crf', '16', '-profile:v', 'high',
+                    '-x264-params', 'aq-mode=2:aq-strength=1.5:mbtree=1:rc-lookahead=60:ref=6:me=umh:subq=9:trellis=2:8x8dct=1'],
+        'h264_nvenc': ['-preset', 'slow', '-rc', 'vbr', '-cq', '16'],
+        'h264_qsv': ['-preset', 'slow', '-global_quality', '16'],
+        'h264_videotoolbox': ['-q:v', '75']
+    }
+}
+DEFAULT_PROFILE = 'archive'
+
+# x264 presets from fastest to slowest, with their approximate encode cost
+# relative to 'medium' and the rc-lookahead the deadline tuner pairs with them
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+X264_PRESET_COST = {
+    'ultrafast': 0.15, 'superfast': 0.22, 'veryfast': 0.35, 'faster': 0.6, 'fast': 0.8,
+    'medium': 1.0, 'slow': 1.6, 'slower': 3.0, 'veryslow': 6.0
+}
+X264_PRESET_LOOKAHEAD = {
+    'ultrafast': 0, 'superfast': 0, 'veryfast': 10, 'faster': 20, 'fast': 30,
+    'medium': 40, 'slow': 50, 'slower': 60, 'veryslow': 60
+}
+
+# Measured throughput is kept per host next to the encoder probe cache
+_stats_lock = threading.Lock()
+_stats = None
+
+def _stats_path():
+    return os.path.join(ENCODER_CACHE_DIR, f"profiles-{socket.gethostname()}.json")
+
+def _load_stats():
+    global _stats
+    if _stats is None:
+        try:
+            with open(_stats_path()) as f:
+                _stats = json.load(f)
+        except (OSError, ValueError):
+            _stats = {}
+    return _stats
+
+def profile_video_args(profile, encoder):
+    settings = PROFILES.get(profile, PROFILES[DEFAULT_PROFILE])
+    if encoder not in settings:
+        encoder = 'libx264'
+    return ['-c:v', encoder, *settings[encoder]]
+
+def profile_preset(profile):
+    args = PROFILES.get(profile, PROFILES[DEFAULT_PROFILE])['libx264']
+    return args[args.index('-preset') + 1] if '-preset' in args else 'medium'
+
+# x264-params that override what a preset sets; a profile pinning them would keep a
+# faster preset close to the profile's own cost
+X264_PRESET_OVERRIDES = ('ref', 'me', 'subq', 'trellis', '8x8dct')
+
+# Swap the x264 preset and rc-lookahead in a libx264 argument list. Stepping below
+# the list's own preset also drops its preset-overriding x264-params, so the encode
+# runs at the cost X264_PRESET_COST assumes.
+def with_x264_preset(args, preset):
+    args = list(args)
+    faster = False
+    if '-preset' in args:
+        pos = args.index('-preset') + 1
+        if args[pos] in X264_PRESETS:
+            faster = X264_PRESETS.index(preset) < X264_PRESETS.index(args[pos])
+        args[pos] = preset
+    else:
+        args += ['-preset', preset]
+    lookahead = f"rc-lookahead={X264_PRESET_LOOKAHEAD[preset]}"
+    if '-x264-params' in args:
+        pos = args.index('-x264-params') + 1
+        params = [p for p in args[pos].split(':') if p and not p.startswith('rc-lookahead=')
+                  and not (faster and p.split('=')[0] in X264_PRESET_OVERRIDES)]
+        args[pos] = ':'.join([*params, lookahead])
+    else:
+        args += ['-x264-params', lookahead]
+    return args
+
+# Slowest preset, never above max_preset, whose projected speed finishes the remaining
+# media within the remaining budget. speed is media seconds per wall second that one
+# encode achieved at measured_preset; workers encodes run side by side.
+def pick_preset_for_deadline(measured_preset, speed, media_remaining, seconds_remaining, workers, max_preset):
+    if seconds_remaining <= 0 or speed <= 0:
+        return X264_PRESETS[0]
+    needed = media_remaining / seconds_remaining / max(workers, 1)
+    choice = X264_PRESETS[0]
+    for preset in X264_PRESETS[:X264_PRESETS.index(max_preset) + 1]:
+        projected = speed * X264_PRESET_COST[measured_preset] / X264_PRESET_COST[preset]
+        # Keep 20% headroom for uploads and estimate error
+        if projected >= needed * 1.2:
+            choice = preset
+    return choice
+
+# Fold one finished encode into the running average for (profile, encoder)
+def record_throughput(profile, encoder, frames, elapsed, output_bytes, media_seconds):
+    if elapsed <= 0 or media_seconds <= 0:
+        return
+    with _stats_lock:
+        stats = _load_stats()
+        entry = stats.setdefault(profile, {}).setdefault(encoder, {'fps': 0.0, 'bytes_per_second': 0.0, 'samples': 0})
+        samples = entry['samples']
+        entry['fps'] = (entry['fps'] * samples + frames / elapsed) / (samples + 1)
+        entry['bytes_per_second'] = (entry['bytes_per_second'] * samples + output_bytes / media_seconds) / (samples + 1)
+        entry['samples'] = samples + 1
+        try:
+            os.makedirs(ENCODER_CACHE_DIR, exist_ok=True)
+            with open(_stats_path(), 'w') as f:
+                json.dump(stats, f)
+        except OSError:
+            pass
+
+def describe_profiles():
+    with _stats_lock:
+        stats = json.loads(json.dumps(_load_stats()))
+    return {
+        name: {'description': settings['description'], 'measured': stats.get(name, {})}
+        for name, settings in PROFILES.items()
+    }
+
+# Encode a synthetic 1080x1920 clip with every profile on the preferred encoder
+def benchmark_profiles(seconds=5, fps=30):
+    encoder = select_encoders()[0]
+    output_path = os.path.join(ENCODER_CACHE_DIR, 'benchmark.mp4')
+    os.makedirs(ENCODER_CACHE_DIR, exist_ok=True)
+    for name in PROFILES:
+        cmd = [
+            'ffmpeg', '-f', 'lavfi', '-i', f'testsrc2=size=1080x1920:rate={fps}:duration={seconds}',
+            *profile_video_args(name, encoder), '-pix_fmt', 'yuv420p', '-y', output_path
+        ]
+        started = time.time()
+        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        elapsed = time.time() - started
+        record_throughput(name, encoder, seconds * fps, elapsed, os.path.getsize(output_path), seconds)
+        print(f"{name}: {seconds * fps / elapsed:.1f} fps, {os.path.getsize(output_path) / seconds / 1024:.0f} KB/s")
+    os.remove(output_path)
+
+if __name__ == '__main__':
+    if '--benchmark' in sys.argv:
+        benchmark_profiles()
+    print(json.dumps(describe_profiles(), indent=2))
@@ -0,0 +1,105 @@
+import os
+import json
+import socket
+import time
+import subprocess
+
+# Fastest first; override with a comma separated ENCODER_PREFERENCE
+DEFAULT_ENCODER_PREFERENCE = ['h264_nvenc', 'h264_qsv', 'h264_videotoolbox', 'libx264']
+ENCODER_PREFERENCE = [name.strip() for name in os.environ.get(
+    'ENCODER_PREFERENCE', ','.join(DEFAULT_ENCODER_PREFERENCE)).split(',') if name.strip()]
+
+# Probe results are cached per host and ffmpeg build
+ENCODER_CACHE_DIR = os.environ.get('ENCODER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'video-cut'))
+
+_capabilities = None
+
+def _ffmpeg_version():
+    result = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return result.stdout.splitlines()[0] if result.stdout else ''
+
+def _list_encoders():
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    encoders = []
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        # Encoder lines look like " V....D libx264    libx264 H.264 ..."
+        if len(fields) >= 2 and len(fields[0]) == 6 and fields[0][0] == 'V':
+            encoders.append(fields[1])
+    return encoders
+
+def _list_hwaccels():
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-hwaccels'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return [line.strip() for line in result.stdout.splitlines()[1:] if line.strip()]
+
+# A listed hardware encoder may still have no device behind it, so encode one frame
+def _encoder_works(encoder):
+    cmd = [
+        'ffmpeg', '-hide_banner', '-f', 'lavfi', '-i', 'color=black:s=256x256:d=0.1',
+        '-frames:v', '1', '-c:v', encoder, '-f', 'null', '-'
+    ]
+    try:
+        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=30)
+        return True
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return False
+
+def probe_capabilities(force=False):
+    global _capabilities
+    if _capabilities is not None and not force:
+        return _capabilities
+
+    cache_path = os.path.join(ENCODER_CACHE_DIR, f"encoders-{socket.gethostname()}.json")
+    version = _ffmpeg_version()
+    if not force and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get('ffmpeg_version') == version:
+                _capabilities = cached
+                return _capabilities
+        except (OSError, ValueError):
+            pass
+
+    listed = _list_encoders()
+    candidates = set(DEFAULT_ENCODER_PREFERENCE) | set(ENCODER_PREFERENCE)
+    _capabilities = {
+        'ffmpeg_version': version,
+        'encoders': [name for name in listed if name in candidates and _encoder_works(name)],
+        'hwaccels': _list_hwaccels()
+    }
+    try:
+        os.makedirs(ENCODER_CACHE_DIR, exist_ok=True)
+        with open(cache_path, 'w') as f:
+            json.dump(_capabilities, f)
+    except OSError:
+        pass
+    return _capabilities
+
+# Usable encoders in preference order
+def select_encoders(preference=None):
+    working = probe_capabilities()['encoders']
+    encoders = [name for name in (preference or ENCODER_PREFERENCE) if name in working]
+    return encoders or ['libx264']
+
+# Run build_cmd(encoder) with each encoder in turn until one succeeds; returns the encoder used.
+# `run` replaces subprocess.run, e.g. to run under a CPU budget. stats (a dict, optional)
+# gets 'elapsed': the successful attempt's run time, as reported by run when it
+# measures it (run_scheduled leaves out the wait for cores), without failed attempts.
+def run_with_encoder_fallback(build_cmd, encoders, run=subprocess.run, stats=None, **run_kwargs):
+    run_kwargs.setdefault('stdout', subprocess.PIPE)
+    run_kwargs.setdefault('stderr', subprocess.PIPE)
+    if not encoders:
+        raise ValueError("No encoders to try")
+    last_error = None
+    for encoder in encoders:
+        try:
+            started = time.time()
+            result = run(build_cmd(encoder), check=True, **run_kwargs)
+            if stats is not None:
+                stats['elapsed'] = getattr(result, 'elapsed', time.time() - started)
+            return encoder
+        except subprocess.CalledProcessError as e:
+            print(f"Encoder {encoder} failed, trying next: {e}")
+            last_error = e
+    raise last_error
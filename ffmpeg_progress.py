@@ -0,0 +1,60 @@
+import threading
+import subprocess
+from collections import deque
+
+# Lines of ffmpeg's stderr kept for error reports
+STDERR_TAIL_LINES = 50
+
+# Run an ffmpeg command with its machine-readable progress channel on stdout and
+# parse it as it streams. progress (a dict, optional) is updated after every report
+# with duration (seconds written), frames, fps, speed and total_size, so the caller
+# gets the output's stats without probing the file afterwards. Extra keyword
+# arguments from subprocess.run callers (stdout, stderr, text) are ignored.
+def run_with_progress(cmd, progress=None, check=True, **run_kwargs):
+    if progress is None:
+        progress = {}
+    cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    # Drain stderr in the background so a chatty ffmpeg can't block on a full pipe
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_thread = threading.Thread(target=lambda: stderr_tail.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+
+    report = {}
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        if key != 'progress':
+            report[key] = value
+            continue
+        # A report ends with progress=continue, the last one with progress=end
+        progress.update(_parse_report(report))
+        progress['done'] = value == 'end'
+        report = {}
+
+    returncode = process.wait()
+    stderr_thread.join()
+    stderr = ''.join(stderr_tail)
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout=None, stderr=stderr)
+
+def _parse_report(report):
+    parsed = {}
+    # out_time_us is the output timestamp in microseconds (N/A before the first frame)
+    out_time = report.get('out_time_us', report.get('out_time_ms', ''))
+    if out_time.lstrip('-').isdigit():
+        parsed['duration'] = max(0, int(out_time)) / 1000000
+    if report.get('frame', '').isdigit():
+        parsed['frames'] = int(report['frame'])
+    if report.get('total_size', '').isdigit():
+        parsed['total_size'] = int(report['total_size'])
+    try:
+        parsed['fps'] = float(report.get('fps', ''))
+    except ValueError:
+        pass
+    try:
+        parsed['speed'] = float(report.get('speed', '').rstrip('x'))
+    except ValueError:
+        pass
+    return parsed
@@ -0,0 +1,210 @@
+import os
+import json
+import hashlib
+import threading
+import subprocess
+from fractions import Fraction
+from collections import namedtuple
+from ffmpeg_encoders import ENCODER_CACHE_DIR
+
+# Probe results are cached by path, size and mtime, so a file is never probed twice.
+# The least recently used results are evicted past MEDIA_PROBE_CACHE_MAX_ENTRIES.
+MEDIA_PROBE_CACHE_DIR = os.environ.get('MEDIA_PROBE_CACHE_DIR', os.path.join(ENCODER_CACHE_DIR, 'probe'))
+MEDIA_PROBE_CACHE_MAX_ENTRIES = int(os.environ.get('MEDIA_PROBE_CACHE_MAX_ENTRIES', 2000))
+
+# width/height are the displayed size, after rotation. fps is the average frame rate;
+# vfr is set when it differs from the stream's base rate. keyframes is None unless
+# requested, else a list of {'time', 'pos', 'gop_frames', 'gop_bytes'} in time order.
+# profile and level are the video codec's, as ffprobe names them (e.g. 'High', 40).
+MediaInfo = namedtuple('MediaInfo', [
+    'duration', 'fps', 'vfr', 'width', 'height', 'rotation', 'bit_rate', 'pix_fmt', 'codec_name',
+    'profile', 'level',
+    'audio_codec_name', 'audio_channels', 'audio_channel_layout', 'audio_sample_rate',
+    'packet_count', 'keyframes'
+])
+
+_memory_cache = {}
+_probed_paths = {}  # Absolute path -> cache files written or read for it by this process
+_cache_lock = threading.Lock()
+
+def _parse_rate(rate):
+    try:
+        value = Fraction(rate or '0/1')
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+    return float(value)
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _cache_path(video_path, stat):
+    key = hashlib.sha1(f"{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()
+    return os.path.join(MEDIA_PROBE_CACHE_DIR, f"{key}.json")
+
+def _ffprobe_json(cmd):
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    return json.loads(result.stdout)
+
+# One ffprobe call for streams and format. When keyframes are needed, a second call
+# lists the packets of the first video stream only (-select_streams would also
+# hide the audio stream from the first), so audio packets are never dumped
+def _run_ffprobe(video_path, keyframes):
+    entries = ('stream=index,codec_type,codec_name,profile,level,width,height,pix_fmt,r_frame_rate,avg_frame_rate,'
+               'bit_rate,duration,channels,channel_layout,sample_rate:stream_tags=rotate:'
+               'stream_side_data=rotation:format=duration,bit_rate')
+    info = _ffprobe_json(['ffprobe', '-v', 'error', '-show_entries', entries, '-of', 'json', video_path])
+    if keyframes:
+        info['packets'] = _ffprobe_json([
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=stream_index,pts_time,size,pos,flags', '-of', 'json', video_path
+        ]).get('packets', [])
+    return info
+
+def _build_keyframe_index(packets, stream_index):
+    keyframes = []
+    packet_count = 0
+    for packet in packets:
+        if packet.get('stream_index') != stream_index:
+            continue
+        packet_count += 1
+        pts_time = packet.get('pts_time')
+        if 'K' in packet.get('flags', '') and pts_time not in (None, 'N/A'):
+            keyframes.append({
+                'time': float(pts_time),
+                'pos': _to_int(packet.get('pos')),
+                'gop_frames': 0,
+                'gop_bytes': 0
+            })
+        if keyframes:
+            # Packets arrive in decode order, so everything up to the next
+            # keyframe belongs to the current GOP
+            keyframes[-1]['gop_frames'] += 1
+            keyframes[-1]['gop_bytes'] += _to_int(packet.get('size')) or 0
+    keyframes.sort(key=lambda kf: kf['time'])
+    return packet_count, keyframes
+
+def _parse_probe(info, keyframes):
+    streams = info.get('streams', [])
+    video_stream = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if video_stream is None:
+        raise ValueError("No video stream found")
+    audio_stream = next((stream for stream in streams if stream.get('codec_type') == 'audio'), {})
+    fmt = info.get('format', {})
+
+    # Side data holds the display matrix angle (counter-clockwise); the older
+    # rotate tag is clockwise. Both end up as clockwise degrees.
+    rotation = 0
+    for side_data in video_stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            rotation = -int(float(side_data['rotation'])) % 360
+    if not rotation and 'rotate' in video_stream.get('tags', {}):
+        rotation = int(video_stream['tags']['rotate']) % 360
+
+    width, height = int(video_stream['width']), int(video_stream['height'])
+    if rotation in (90, 270):
+        width, height = height, width
+
+    base_fps = _parse_rate(video_stream.get('r_frame_rate'))
+    avg_fps = _parse_rate(video_stream.get('avg_frame_rate')) or base_fps
+    duration = fmt.get('duration') or video_stream.get('duration')
+
+    packet_count, keyframe_index = None, None
+    if keyframes:
+        packet_count, keyframe_index = _build_keyframe_index(info.get('packets', []), video_stream.get('index'))
+
+    return MediaInfo(
+        duration=float(duration) if duration not in (None, 'N/A') else 0.0,
+        fps=avg_fps,
+        vfr=bool(base_fps and avg_fps and abs(base_fps - avg_fps) / base_fps > 0.01),
+        width=width,
+        height=height,
+        rotation=rotation,
+        bit_rate=_to_int(video_stream.get('bit_rate')) or _to_int(fmt.get('bit_rate')),
+        pix_fmt=video_stream.get('pix_fmt') or 'yuv420p',
+        codec_name=video_stream.get('codec_name'),
+        profile=video_stream.get('profile'),
+        level=_to_int(video_stream.get('level')),
+        audio_codec_name=audio_stream.get('codec_name'),
+        audio_channels=_to_int(audio_stream.get('channels')),
+        audio_channel_layout=audio_stream.get('channel_layout'),
+        audio_sample_rate=_to_int(audio_stream.get('sample_rate')),
+        packet_count=packet_count,
+        keyframes=keyframe_index
+    )
+
+# Probe a media file once; keyframes=True also reads the packet list (demux only,
+# no decoding). Cached results are reused until the file's size or mtime changes.
+def probe_media(video_path, keyframes=False):
+    stat = os.stat(video_path)
+    cache_path = _cache_path(video_path, stat)
+
+    with _cache_lock:
+        media_info = _memory_cache.get(cache_path)
+        _probed_paths.setdefault(os.path.abspath(video_path), set()).add(cache_path)
+    if media_info is None and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                media_info = MediaInfo(**json.load(f))
+            # The file's mtime is the entry's last use
+            os.utime(cache_path)
+        except (OSError, ValueError, TypeError):
+            media_info = None
+    if media_info is not None and (media_info.keyframes is not None or not keyframes):
+        with _cache_lock:
+            _memory_cache[cache_path] = media_info
+        return media_info
+
+    media_info = _parse_probe(_run_ffprobe(video_path, keyframes), keyframes)
+    with _cache_lock:
+        _memory_cache[cache_path] = media_info
+    try:
+        os.makedirs(MEDIA_PROBE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(media_info._asdict(), f)
+        os.replace(tmp_path, cache_path)
+        with _cache_lock:
+            _evict()
+    except OSError:
+        pass
+    return media_info
+
+# Drop least recently used results until the cache fits its limit (caller holds the lock)
+def _evict():
+    entries = []
+    for name in os.listdir(MEDIA_PROBE_CACHE_DIR):
+        if name.endswith('.json'):
+            path = os.path.join(MEDIA_PROBE_CACHE_DIR, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+    for _, path in sorted(entries)[:max(0, len(entries) - MEDIA_PROBE_CACHE_MAX_ENTRIES)]:
+        _memory_cache.pop(path, None)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def get_keyframe_times(video_path):
+    return [kf['time'] for kf in probe_media(video_path, keyframes=True).keyframes]
+
+# Drop the cached probes of a file that is about to be deleted: the one for its
+# current size and mtime, and any taken earlier (e.g. while it was still uploading)
+def forget_media(video_path):
+    with _cache_lock:
+        cache_paths = _probed_paths.pop(os.path.abspath(video_path), set())
+    try:
+        cache_paths.add(_cache_path(video_path, os.stat(video_path)))
+    except OSError:
+        pass
+    for cache_path in cache_paths:
+        with _cache_lock:
+            _memory_cache.pop(cache_path, None)
+        try:
+            os.remove(cache_path)
+        except OSError:
+            pass
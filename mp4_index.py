@@ -0,0 +1,163 @@
+import struct
+import bisect
+
+# Sample tables of an MP4/MOV read straight from the moov box, so the byte range
+# holding any time range is known before the rest of the file has arrived.
+
+# Containers whose children are walked on the way to the sample tables
+_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+class NotFaststart(Exception):
+    pass
+
+# Top-level boxes from the start of the file. read_at(offset, length) returns the bytes
+# or None while they haven't arrived. Returns the moov payload, None if it isn't
+# available yet, and raises NotFaststart when media data comes before the moov.
+def read_moov(read_at, file_size):
+    offset = 0
+    while offset + 8 <= file_size:
+        header = read_at(offset, 16 if offset + 16 <= file_size else 8)
+        if header is None:
+            return None
+        size, box_type = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return None
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise NotFaststart("Malformed box header")
+        if box_type == b'moov':
+            return read_at(offset + header_size, size - header_size)
+        if box_type == b'mdat':
+            raise NotFaststart("Media data comes before the moov box")
+        offset += size
+    raise NotFaststart("No moov box")
+
+def _boxes(data):
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size:
+            return
+        yield box_type, data[offset + header_size:offset + size]
+        offset += size
+
+def _collect(data, found, path=()):
+    for box_type, payload in _boxes(data):
+        if box_type == b'trak':
+            found.append({})
+        if box_type in _CONTAINERS:
+            _collect(payload, found, path + (box_type,))
+        elif found and path and path[-1] in (b'mdia', b'stbl'):
+            found[-1][box_type] = payload
+
+# Entry table of a full box: version/flags, entry count, then fixed-size entries
+def _full_box_entries(payload, fmt):
+    count = struct.unpack('>I', payload[4:8])[0]
+    item = struct.calcsize(fmt)
+    return list(struct.iter_unpack(fmt, payload[8:8 + count * item]))
+
+def _track_samples(boxes):
+    mdhd = boxes[b'mdhd']
+    if mdhd[0] == 1:
+        timescale = struct.unpack('>I', mdhd[20:24])[0]
+    else:
+        timescale = struct.unpack('>I', mdhd[12:16])[0]
+    handler = boxes[b'hdlr'][8:12].decode('latin-1') if b'hdlr' in boxes else ''
+
+    # Sample sizes
+    if b'stsz' in boxes:
+        stsz = boxes[b'stsz']
+        uniform_size, count = struct.unpack('>II', stsz[4:12])
+        sizes = [uniform_size] * count if uniform_size else list(struct.unpack(f'>{count}I', stsz[12:12 + 4 * count]))
+    else:
+        stz2 = boxes[b'stz2']
+        field_size, count = stz2[7], struct.unpack('>I', stz2[8:12])[0]
+        if field_size == 16:
+            sizes = list(struct.unpack(f'>{count}H', stz2[12:12 + 2 * count]))
+        elif field_size == 8:
+            sizes = list(stz2[12:12 + count])
+        else:
+            packed = stz2[12:12 + (count + 1) // 2]
+            sizes = [(packed[n // 2] >> (4 if n % 2 == 0 else 0)) & 0x0F for n in range(count)]
+
+    # Chunk offsets, then sample offsets from the sample-to-chunk runs
+    if b'co64' in boxes:
+        chunk_offsets = [entry[0] for entry in _full_box_entries(boxes[b'co64'], '>Q')]
+    else:
+        chunk_offsets = [entry[0] for entry in _full_box_entries(boxes[b'stco'], '>I')]
+    runs = _full_box_entries(boxes[b'stsc'], '>III')
+    offsets = []
+    sample = 0
+    for run, (first_chunk, samples_per_chunk, _) in enumerate(runs):
+        last_chunk = runs[run + 1][0] - 1 if run + 1 < len(runs) else len(chunk_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            position = chunk_offsets[chunk]
+            for _ in range(samples_per_chunk):
+                if sample >= len(sizes):
+                    break
+                offsets.append(position)
+                position += sizes[sample]
+                sample += 1
+
+    # Decode times from the time-to-sample runs
+    times = []
+    dts = 0
+    for count, delta in _full_box_entries(boxes[b'stts'], '>II'):
+        for _ in range(count):
+            times.append(dts / timescale)
+            dts += delta
+
+    # No stss means every sample is a sync sample
+    sync = None
+    if b'stss' in boxes:
+        sync = [entry[0] - 1 for entry in _full_box_entries(boxes[b'stss'], '>I')]
+
+    count = min(len(sizes), len(offsets), len(times))
+    return {'handler': handler, 'times': times[:count], 'offsets': offsets[:count],
+            'sizes': sizes[:count], 'sync': sync}
+
+# Per-track sample tables of a moov payload; ValueError if they can't be read
+def parse_moov(moov):
+    found = []
+    tracks = []
+    try:
+        _collect(moov, found)
+        for boxes in found:
+            if b'mdhd' in boxes and b'stts' in boxes and b'stsc' in boxes and (b'stco' in boxes or b'co64' in boxes) \
+                    and (b'stsz' in boxes or b'stz2' in boxes):
+                tracks.append(_track_samples(boxes))
+    except (struct.error, IndexError, KeyError, ZeroDivisionError) as e:
+        raise ValueError(f"Unreadable sample tables: {e}")
+    return tracks
+
+# File byte range [start, end) holding every sample a decoder needs for
+# [start_time, end_time): video from the sync sample at or before start_time,
+# all tracks padded by margin seconds for reordering and demuxer read-ahead
+def byte_range_for_time(tracks, start_time, end_time, margin=1.0):
+    first, last = None, None
+    for track in tracks:
+        times = track['times']
+        if not times:
+            continue
+        begin = bisect.bisect_left(times, start_time - margin)
+        if track['handler'] == 'vide' and track['sync']:
+            sync_pos = bisect.bisect_right(track['sync'], bisect.bisect_right(times, start_time) - 1) - 1
+            begin = min(begin, track['sync'][max(sync_pos, 0)])
+        stop = bisect.bisect_left(times, end_time + margin)
+        for n in range(begin, min(stop, len(times))):
+            sample_start = track['offsets'][n]
+            sample_end = sample_start + track['sizes'][n]
+            first = sample_start if first is None else min(first, sample_start)
+            last = sample_end if last is None else max(last, sample_end)
+    return first, last
@@ -1,7 +1,6 @@
 import os
 import subprocess
 import math
-import json
 import asyncio
 import telebot
 from telebot.async_telebot import AsyncTeleBot
@@ -12,6 +11,9 @@ import threading
 import time
 import uuid
 import shutil
+from ffmpeg_progress import run_with_progress
+from media_probe import probe_media, forget_media
+from title_overlays import render_title_frame, build_overlay_filter
 
 # Set a longer timeout for Telegram API requests
 apihelper.TIMEOUT = 600  # 10 minutes
@@ -62,53 +64,14 @@ async def process_video(video_path, message_id):
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
         
-        # Get video information using ffprobe
-        def get_video_info(video_path):
-            cmd = [
-                'ffprobe', 
-                '-v', 'error', 
-                '-select_streams', 'v:0', 
-                '-show_entries', 'stream=duration,r_frame_rate,width,height,bit_rate,pix_fmt', 
-                '-show_entries', 'format=duration,bit_rate', 
-                '-of', 'json', 
-                video_path
-            ]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            info = json.loads(result.stdout)
-            
-            video_stream = info['streams'][0]
-            fps = eval(video_stream['r_frame_rate'])
-            width = int(video_stream['width'])
-            height = int(video_stream['height'])
-            duration = float(info['format']['duration'])
-            
-            # Get bit rate (stream or format)
-            bit_rate = video_stream.get('bit_rate')
-            if not bit_rate:
-                bit_rate = info['format'].get('bit_rate')
-            if bit_rate:
-                bit_rate = int(bit_rate)
-            
-            # Get pixel format
-            pix_fmt = video_stream.get('pix_fmt', 'yuv420p')
-            
-            return {
-                'duration': duration,
-                'fps': fps,
-                'width': width,
-                'height': height,
-                'bit_rate': bit_rate,
-                'pix_fmt': pix_fmt
-            }
-        
-        # Get video info
-        video_info = get_video_info(video_path)
-        duration = video_info['duration']
-        fps = video_info['fps']
-        width = video_info['width']
-        height = video_info['height']
-        bit_rate = video_info['bit_rate']
-        pix_fmt = video_info['pix_fmt']
+        # Get video info (cached per file)
+        video_info = await asyncio.to_thread(probe_media, video_path)
+        duration = video_info.duration
+        fps = video_info.fps
+        width = video_info.width
+        height = video_info.height
+        bit_rate = video_info.bit_rate
+        pix_fmt = video_info.pix_fmt
         
         # Calculate number of parts
         part_duration = 15  # seconds
@@ -163,14 +126,18 @@ async def process_video(video_path, message_id):
             # If original bitrate is available, use it; otherwise use a high default
             target_bitrate = bit_rate if bit_rate else 8000000  # 8Mbps default
             
+            # Black bars with the part label, rendered once and reused across runs
+            title_frame = await asyncio.to_thread(render_title_frame, f'Part {i+1}', font_path, target_width, target_height, style='dark_glow')
+            
             # Build FFmpeg command with high quality settings
             cmd = [
                 'ffmpeg',
                 '-ss', str(start_time),
                 '-i', video_path,
+                '-loop', '1', '-i', title_frame,
                 '-t', str(part_duration_actual),
-                '-vf', 
-                f'scale={target_width}:{middle_height}:force_original_aspect_ratio=decrease,pad={target_width}:{middle_height}:(ow-iw)/2:(oh-ih)/2:color=black,pad={target_width}:{target_height}:0:{top_bar_height}:color=black,drawtext=text=\'Part {i+1}\':fontfile={font_path}:fontsize=80:x=(w-tw)/2:y=(h-th)/10:fontcolor=white:shadowcolor=white:shadowx=3:shadowy=3',
+                '-filter_complex', build_overlay_filter(target_width, top_bar_height, middle_height, 'dark_glow'),
+                '-map', '[v]', '-map', '0:a:0?',
                 '-c:v', 'libx264',  # Software encoding for compatibility
                 '-preset', 'slow',   # Slower preset for better quality
                 '-crf', '18',       # Lower CRF for higher quality (18 is visually lossless)
@@ -187,19 +154,11 @@ async def process_video(video_path, message_id):
                 output_path
             ]
             
-            # Run FFmpeg
-            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            
-            # Verify output duration
-            verify_cmd = [
-                'ffprobe', 
-                '-v', 'error', 
-                '-show_entries', 'format=duration', 
-                '-of', 'default=noprint_wrappers=1:nokey=1', 
-                output_path
-            ]
-            result = subprocess.run(verify_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            output_duration = float(result.stdout.strip())
+            # Run FFmpeg; output duration and speed come from its progress reports
+            progress = {}
+            await asyncio.to_thread(run_with_progress, cmd, progress=progress)
+            print(f"Part {i+1}: {progress.get('duration', 0.0):.2f}s, {progress.get('frames', 0)} frames, "
+                  f"{progress.get('speed', 0):.2f}x")
             
             # Send the processed part with retry
             for attempt in range(max_retries):
@@ -245,6 +204,7 @@ async def process_video(video_path, message_id):
     finally:
         # Clean up original video
         if os.path.exists(video_path):
+            forget_media(video_path)
             os.remove(video_path)
 
 # Function to run the bot's event loop
@@ -339,10 +299,23 @@ def upload_chunk():
     if not chunk_data:
         return jsonify({"error": "No chunk data provided"}), 400
     
-    chunk_data.save(chunk_file)
+    # Saved under a temporary name so an interrupted chunk never counts as received
+    chunk_data.save(f"{chunk_file}.part")
+    os.replace(f"{chunk_file}.part", chunk_file)
     
     return jsonify({"success": True})
 
+# Chunks the server already has, so a client can resume and send only the rest
+@app.route('/upload_status')
+def upload_status():
+    upload_id = request.args.get('upload_id', '')
+    upload_dir = os.path.join(app.config['CHUNKS_FOLDER'], secure_filename(upload_id))
+    if not upload_id or not os.path.isdir(upload_dir):
+        return jsonify({"error": "Unknown upload ID"}), 404
+    received = sorted(int(name.split('_')[1]) for name in os.listdir(upload_dir)
+                      if name.startswith('chunk_') and not name.endswith('.part'))
+    return jsonify({"upload_id": upload_id, "received": received})
+
 @app.route('/complete_upload', methods=['POST'])
 def complete_upload():
     if not bot_ready:
@@ -359,7 +332,7 @@ def complete_upload():
         return jsonify({"error": "Invalid upload ID"}), 400
     
     # Get all chunk files
-    chunk_files = sorted([f for f in os.listdir(upload_dir) if f.startswith('chunk_')], 
+    chunk_files = sorted([f for f in os.listdir(upload_dir) if f.startswith('chunk_') and not f.endswith('.part')], 
                          key=lambda x: int(x.split('_')[1]))
     
     if not chunk_files:
@@ -517,6 +490,9 @@ with open('templates/index.html', 'w') as f:
             const progressBar = document.getElementById('progress-bar');
             const statusDiv = document.getElementById('status');
             
+            const PARALLEL_UPLOADS = 4;
+            const MAX_CHUNK_ATTEMPTS = 5;
+            
             form.addEventListener('submit', async function(e) {
                 e.preventDefault();
                 
@@ -536,53 +512,91 @@ with open('templates/index.html', 'w') as f:
                 showStatus('Initializing upload...', true);
                 
                 try {
-                    // Initialize upload
-                    const initResponse = await fetch('/init_upload', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
+                    // Resume an interrupted upload of the same file, else start a new one
+                    const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+                    let uploadId = localStorage.getItem(resumeKey);
+                    let received = new Set();
+                    if (uploadId) {
+                        const statusResponse = await fetch(`/upload_status?upload_id=${encodeURIComponent(uploadId)}`);
+                        if (statusResponse.ok) {
+                            received = new Set((await statusResponse.json()).received);
+                        } else {
+                            uploadId = null;
                         }
-                    });
-                    
-                    const initData = await initResponse.json();
-                    
-                    if (initData.error) {
-                        throw new Error(initData.error);
                     }
                     
-                    const uploadId = initData.upload_id;
-                    
-                    // Upload chunks
-                    for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
-                        const start = chunkIndex * chunkSize;
-                        const end = Math.min(file.size, start + chunkSize);
-                        const chunk = file.slice(start, end);
-                        
-                        const formData = new FormData();
-                        formData.append('upload_id', uploadId);
-                        formData.append('chunk_index', chunkIndex);
-                        formData.append('total_chunks', totalChunks);
-                        formData.append('file_name', file.name);
-                        formData.append('chunk', chunk);
-                        
-                        const progress = Math.round(((chunkIndex + 1) / totalChunks) * 100);
-                        progressBar.style.width = progress + '%';
-                        progressBar.textContent = progress + '%';
-                        
-                        showStatus(`Uploading chunk ${chunkIndex + 1} of ${totalChunks}...`, true);
-                        
-                        const response = await fetch('/upload_chunk', {
+                    if (!uploadId) {
+                        const initResponse = await fetch('/init_upload', {
                             method: 'POST',
-                            body: formData
+                            headers: {
+                                'Content-Type': 'application/json'
+                            }
                         });
                         
-                        const data = await response.json();
+                        const initData = await initResponse.json();
                         
-                        if (data.error) {
-                            throw new Error(data.error);
+                        if (initData.error) {
+                            throw new Error(initData.error);
                         }
+                        
+                        uploadId = initData.upload_id;
+                        localStorage.setItem(resumeKey, uploadId);
                     }
                     
+                    // Upload the missing chunks, PARALLEL_UPLOADS at a time
+                    const pending = [];
+                    for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
+                        if (!received.has(chunkIndex)) {
+                            pending.push(chunkIndex);
+                        }
+                    }
+                    let uploaded = totalChunks - pending.length;
+                    
+                    // A failed chunk is retried with backoff instead of restarting the upload
+                    async function uploadChunk(chunkIndex) {
+                        const start = chunkIndex * chunkSize;
+                        const chunk = file.slice(start, Math.min(file.size, start + chunkSize));
+                        for (let attempt = 1; ; attempt++) {
+                            try {
+                                const formData = new FormData();
+                                formData.append('upload_id', uploadId);
+                                formData.append('chunk_index', chunkIndex);
+                                formData.append('total_chunks', totalChunks);
+                                formData.append('file_name', file.name);
+                                formData.append('chunk', chunk);
+                                
+                                const response = await fetch('/upload_chunk', {
+                                    method: 'POST',
+                                    body: formData
+                                });
+                                const data = await response.json();
+                                
+                                if (data.error) {
+                                    throw new Error(data.error);
+                                }
+                                return;
+                            } catch (error) {
+                                if (attempt >= MAX_CHUNK_ATTEMPTS) {
+                                    throw error;
+                                }
+                                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+                            }
+                        }
+                    }
+                    
+                    async function uploadWorker() {
+                        while (pending.length > 0) {
+                            await uploadChunk(pending.shift());
+                            uploaded++;
+                            const progress = Math.round((uploaded / totalChunks) * 100);
+                            progressBar.style.width = progress + '%';
+                            progressBar.textContent = progress + '%';
+                            showStatus(`Uploaded ${uploaded} of ${totalChunks} chunks...`, true);
+                        }
+                    }
+                    
+                    await Promise.all(Array.from({ length: PARALLEL_UPLOADS }, uploadWorker));
+                    
                     // Complete upload
                     showStatus('Finalizing upload...', true);
                     
@@ -600,6 +614,7 @@ with open('templates/index.html', 'w') as f:
                     if (completeData.error) {
                         throw new Error(completeData.error);
                     }
+                    localStorage.removeItem(resumeKey);
                     
                     showStatus(completeData.message, true);
                     form.reset();
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from ffmpeg_encoders import ENCODER_CACHE_DIR
+
+# Finished parts of earlier jobs, keyed by input content and job settings.
+# The least recently used jobs are evicted once the cache outgrows PART_CACHE_MAX_BYTES.
+PART_CACHE_DIR = os.environ.get('PART_CACHE_DIR', os.path.join(ENCODER_CACHE_DIR, 'parts'))
+PART_CACHE_MAX_BYTES = int(os.environ.get('PART_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+
+_cache_lock = threading.Lock()
+
+# SHA-256 of a file's content, read in 1MB blocks
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Cache key for a job: the input's content hash plus every setting that changes the output
+def job_cache_key(content_hash, settings):
+    return hashlib.sha256(f"{content_hash}|{json.dumps(settings, sort_keys=True)}".encode()).hexdigest()
+
+def _entry_dir(key):
+    return os.path.join(PART_CACHE_DIR, key)
+
+def _link_or_copy(source, destination):
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+# Cached parts as [(i, [paths])] in delivery order, or None on a miss. The files are
+# linked (or copied) into pin_dir under the cache lock and the paths point there, so
+# another job's commit can evict the entry while this one is still sending it.
+def lookup_parts(key, pin_dir):
+    manifest_path = os.path.join(_entry_dir(key), 'manifest.json')
+    with _cache_lock:
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not all(os.path.exists(os.path.join(_entry_dir(key), path)) for _, paths in manifest['parts'] for path in paths):
+            return None
+        for _, paths in manifest['parts']:
+            for path in paths:
+                _link_or_copy(os.path.join(_entry_dir(key), path), os.path.join(pin_dir, path))
+        # The manifest's mtime is the entry's last use
+        os.utime(manifest_path)
+    return [(i, [os.path.join(pin_dir, path) for path in paths]) for i, paths in manifest['parts']]
+
+# Parts are hard-linked (or copied) into a staging folder while the job delivers
+# them, and only become visible to lookups once commit_parts succeeds
+def begin_parts(key):
+    stage_dir = os.path.join(PART_CACHE_DIR, f".{key}.{os.getpid()}.{threading.get_ident()}")
+    os.makedirs(stage_dir, exist_ok=True)
+    return {'key': key, 'dir': stage_dir, 'parts': []}
+
+# Add part i; relative_paths keeps layout sub-folders (and so captions) intact
+def stage_part(stage, i, output_paths, base_folder):
+    relative_paths = []
+    for output_path in output_paths:
+        relative_path = os.path.relpath(output_path, base_folder)
+        _link_or_copy(output_path, os.path.join(stage['dir'], relative_path))
+        relative_paths.append(relative_path)
+    stage['parts'].append((i, relative_paths))
+
+def commit_parts(stage):
+    with open(os.path.join(stage['dir'], 'manifest.json'), 'w') as f:
+        json.dump({'parts': stage['parts'], 'created': time.time()}, f)
+    entry_dir = _entry_dir(stage['key'])
+    with _cache_lock:
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(stage['dir'], entry_dir)
+        _evict()
+
+def discard_parts(stage):
+    shutil.rmtree(stage['dir'], ignore_errors=True)
+
+def _entry_size(entry_dir):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(entry_dir) for name in names)
+
+# Drop least recently used entries until the cache fits its limit (caller holds the lock)
+def _evict():
+    entries = []
+    for name in os.listdir(PART_CACHE_DIR):
+        manifest_path = os.path.join(PART_CACHE_DIR, name, 'manifest.json')
+        if name.startswith('.') or not os.path.exists(manifest_path):
+            continue
+        entry_dir = os.path.join(PART_CACHE_DIR, name)
+        entries.append((os.path.getmtime(manifest_path), _entry_size(entry_dir), entry_dir))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries):
+        if total <= PART_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+def cache_status():
+    with _cache_lock:
+        if not os.path.isdir(PART_CACHE_DIR):
+            return {'entries': 0, 'bytes': 0, 'max_bytes': PART_CACHE_MAX_BYTES}
+        entries = [os.path.join(PART_CACHE_DIR, name) for name in os.listdir(PART_CACHE_DIR)
+                   if not name.startswith('.')]
+        return {
+            'entries': len(entries),
+            'bytes': sum(_entry_size(entry_dir) for entry_dir in entries),
+            'max_bytes': PART_CACHE_MAX_BYTES
+        }
+
+# Telegram file_ids of delivered parts, per cache key. Re-sending a file_id needs no
+# upload; it only works for the bot that sent the file, so callers fall back on failure.
+FILE_ID_CACHE_PATH = os.path.join(ENCODER_CACHE_DIR, 'telegram-file-ids.json')
+FILE_ID_CACHE_MAX_ENTRIES = int(os.environ.get('FILE_ID_CACHE_MAX_ENTRIES', 5000))
+
+_file_ids_lock = threading.Lock()
+_file_ids = None
+
+def _load_file_ids():
+    global _file_ids
+    if _file_ids is None:
+        try:
+            with open(FILE_ID_CACHE_PATH) as f:
+                _file_ids = json.load(f)
+        except (OSError, ValueError):
+            _file_ids = {}
+    return _file_ids
+
+def _save_file_ids():
+    try:
+        os.makedirs(ENCODER_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{FILE_ID_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(_file_ids, f)
+        os.replace(tmp_path, FILE_ID_CACHE_PATH)
+    except OSError:
+        pass
+
+# Sent parts as [(i, [[file_id, caption], ...])] in delivery order, or None
+def lookup_file_ids(key):
+    with _file_ids_lock:
+        entry = _load_file_ids().get(key)
+        if entry is None:
+            return None
+        entry['used'] = time.time()
+        _save_file_ids()
+        return [(i, files) for i, files in entry['parts']]
+
+def record_file_ids(key, parts):
+    with _file_ids_lock:
+        file_ids = _load_file_ids()
+        file_ids[key] = {'parts': parts, 'used': time.time()}
+        # Keep the most recently used entries
+        for old_key in sorted(file_ids, key=lambda k: file_ids[k]['used'])[:-FILE_ID_CACHE_MAX_ENTRIES]:
+            del file_ids[old_key]
+        _save_file_ids()
+
+def forget_file_ids(key):
+    with _file_ids_lock:
+        if _load_file_ids().pop(key, None) is not None:
+            _save_file_ids()
@@ -1,10 +1,14 @@
 import os
-import subprocess
 import math
-import json
 import asyncio
+import functools
 import telebot
 from telebot.async_telebot import AsyncTeleBot
+from ffmpeg_encoders import select_encoders, run_with_encoder_fallback
+from encoding_profiles import profile_video_args
+from media_probe import probe_media, forget_media
+from title_overlays import render_title_frame, build_overlay_filter
+from ffmpeg_progress import run_with_progress
 
 # Bot initialization - REPLACE WITH YOUR ACTUAL TOKEN
 TOKEN = "8396391757:AAFS0YHU0YniXvOxrocNab2uAeY56Cu4GKA"
@@ -12,45 +16,19 @@ bot = AsyncTeleBot(TOKEN)
 
 # Video processing function
 async def process_video(video_path, chat_id, message_id):
+    delivery_task = None
     try:
         # Create output folder
         output_folder = f"video_parts_{chat_id}_{message_id}"
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
 
-        # Get video information using ffprobe
-        def get_video_info(video_path):
-            cmd = [
-                'ffprobe',
-                '-v', 'error',
-                '-select_streams', 'v:0',
-                '-show_entries', 'stream=duration,r_frame_rate,width,height',
-                '-show_entries', 'format=duration',
-                '-of', 'json',
-                video_path
-            ]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            info = json.loads(result.stdout)
-
-            video_stream = info['streams'][0]
-            fps = eval(video_stream['r_frame_rate'])
-            width = int(video_stream['width'])
-            height = int(video_stream['height'])
-            duration = float(info['format']['duration'])
-
-            return {
-                'duration': duration,
-                'fps': fps,
-                'width': width,
-                'height': height
-            }
-
-        # Get video info
-        video_info = get_video_info(video_path)
-        duration = video_info['duration']
-        fps = video_info['fps']
-        width = video_info['width']
-        height = video_info['height']
+        # Get video info (cached per file)
+        video_info = await asyncio.to_thread(probe_media, video_path)
+        duration = video_info.duration
+        fps = video_info.fps
+        width = video_info.width
+        height = video_info.height
 
         # Calculate number of parts
         part_duration = 15  # seconds
@@ -77,7 +55,39 @@ async def process_video(video_path, chat_id, message_id):
         if not font_path:
             font_path = "arial"  # FFmpeg will use default
 
-        # Process each part
+        # Fastest working encoder first (probe is cached per host)
+        encoders = select_encoders()
+
+        # Upload stage: sends parts in order while the next ones encode.
+        # The queue is bounded so encoding can't run far ahead of uploads
+        delivery_queue = asyncio.Queue(maxsize=2)
+
+        async def deliver_parts():
+            while True:
+                item = await delivery_queue.get()
+                if item is None:
+                    break
+                i, output_path = item
+
+                # Send the processed part
+                with open(output_path, 'rb') as video_file:
+                    await bot.send_video(chat_id, video_file, caption=f"Part {i+1}/{num_parts}")
+
+                # Clean up the part file
+                os.remove(output_path)
+
+        delivery_task = asyncio.create_task(deliver_parts())
+
+        # Queue an item for the upload stage; raises if an upload failed
+        async def hand_off(item):
+            put = asyncio.ensure_future(delivery_queue.put(item))
+            await asyncio.wait([put, delivery_task], return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                put.cancel()
+            if delivery_task.done():
+                delivery_task.result()
+
+        # Encode stage: process each part
         for i in range(num_parts):
             start_time = i * part_duration
             end_time = min((i + 1) * part_duration, duration)
@@ -90,18 +100,20 @@ async def process_video(video_path, chat_id, message_id):
             # Output filename
             output_path = os.path.join(output_folder, f"part_{i+1}.mp4")
 
+            # Black bars with the part label, rendered once and reused across runs
+            title_frame = await asyncio.to_thread(render_title_frame, f'Part {i+1}', font_path,
+                                                  target_width, target_height, style='dark_glow')
+
             # FFmpeg command with black background and white text
-            cmd = [
+            cmd = lambda encoder: [
                 'ffmpeg',
                 '-ss', str(start_time),
                 '-i', video_path,
+                '-loop', '1', '-i', title_frame,
                 '-t', str(part_duration_actual),
-                '-vf',
-                f'scale={target_width}:{middle_height}:force_original_aspect_ratio=decrease,pad={target_width}:{middle_height}:(ow-iw)/2:(oh-ih)/2:color=black,pad={target_width}:{target_height}:0:{top_bar_height}:color=black,drawtext=text=\'Part {i+1}\':fontfile={font_path}:fontsize=80:x=(w-tw)/2:y=(h-th)/10:fontcolor=white:shadowcolor=white:shadowx=3:shadowy=3',
-                '-c:v', 'h264_nvenc',  # NVIDIA GPU encoding
-                '-preset', 'fast',
-                '-rc', 'vbr',  # Variable bitrate
-                '-cq', '20',    # Quality level
+                '-filter_complex', build_overlay_filter(target_width, top_bar_height, middle_height, 'dark_glow'),
+                '-map', '[v]', '-map', '0:a:0?',
+                *profile_video_args('fast', encoder),  # GPU encoding when available
                 '-c:a', 'aac',
                 '-b:a', '192k',
                 '-movflags', '+faststart',
@@ -111,26 +123,20 @@ async def process_video(video_path, chat_id, message_id):
                 output_path
             ]
 
-            # Run FFmpeg
-            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-
-            # Verify output duration
-            verify_cmd = [
-                'ffprobe',
-                '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                output_path
-            ]
-            result = subprocess.run(verify_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            output_duration = float(result.stdout.strip())
+            # Run FFmpeg in a thread, retrying on the next encoder if this one fails.
+            # Output duration and speed come from ffmpeg's progress reports
+            progress = {}
+            await asyncio.to_thread(run_with_encoder_fallback, cmd, encoders,
+                                    run=functools.partial(run_with_progress, progress=progress))
+            print(f"Part {i+1}: {progress.get('duration', 0.0):.2f}s, {progress.get('frames', 0)} frames, "
+                  f"{progress.get('speed', 0):.2f}x")
 
-            # Send the processed part
-            with open(output_path, 'rb') as video_file:
-                await bot.send_video(chat_id, video_file, caption=f"Part {i+1}/{num_parts}")
+            # Hand the part to the upload stage; waits if two parts are already queued
+            await hand_off((i, output_path))
 
-            # Clean up the part file
-            os.remove(output_path)
+        # Wait for the remaining uploads
+        await hand_off(None)
+        await delivery_task
 
         # Clean up the output folder
         os.rmdir(output_folder)
@@ -141,8 +147,13 @@ async def process_video(video_path, chat_id, message_id):
     except Exception as e:
         await bot.send_message(chat_id, f"❌ Error processing video: {str(e)}")
     finally:
+        # Stop the upload stage if encoding failed
+        if delivery_task and not delivery_task.done():
+            delivery_task.cancel()
+
         # Clean up original video
         if os.path.exists(video_path):
+            forget_media(video_path)
             os.remove(video_path)
 
 # Handle video messages
@@ -1,7 +1,6 @@
 import os
 import subprocess
 import math
-import json
 import asyncio
 import telebot
 from telebot.async_telebot import AsyncTeleBot
@@ -12,6 +11,8 @@ import threading
 import time
 import uuid
 import shutil
+from media_probe import probe_media, forget_media
+from title_overlays import render_title_frame, build_overlay_filter
 
 # Configuration
 apihelper.TIMEOUT = 600
@@ -53,28 +54,9 @@ async def process_video(video_path, message_id, part_duration=15):
         output_folder = f"video_parts_{message_id}"
         os.makedirs(output_folder, exist_ok=True)
         
-        # Get video info
-        def get_video_info(video_path):
-            cmd = [
-                'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-                '-show_entries', 'stream=duration,r_frame_rate,width,height,bit_rate,pix_fmt',
-                '-show_entries', 'format=duration,bit_rate', '-of', 'json', video_path
-            ]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            info = json.loads(result.stdout)
-            
-            video_stream = info['streams'][0]
-            return {
-                'duration': float(info['format']['duration']),
-                'fps': eval(video_stream['r_frame_rate']),
-                'width': int(video_stream['width']),
-                'height': int(video_stream['height']),
-                'bit_rate': video_stream.get('bit_rate') or info['format'].get('bit_rate'),
-                'pix_fmt': video_stream.get('pix_fmt', 'yuv420p')
-            }
-        
-        video_info = get_video_info(video_path)
-        duration = video_info['duration']
+        # Get video info (cached per file)
+        video_info = await asyncio.to_thread(probe_media, video_path)
+        duration = video_info.duration
         num_parts = math.ceil(duration / part_duration)
         
         # Target dimensions
@@ -103,25 +85,26 @@ async def process_video(video_path, message_id, part_duration=15):
                 continue
                 
             output_path = os.path.join(output_folder, f"part_{i+1}.mp4")
-            target_bitrate = int(video_info['bit_rate']) if video_info['bit_rate'] else 8000000
+            target_bitrate = video_info.bit_rate or 8000000
+            
+            # Black bars with the part label, rendered once and reused across runs
+            title_frame = await asyncio.to_thread(render_title_frame, f'Part {i+1}', font_path, target_width, target_height, style='dark_glow')
             
             # Enhanced FFmpeg command for higher quality
             cmd = [
-                'ffmpeg', '-ss', str(start_time), '-i', video_path, '-t', str(part_duration_actual),
-                '-vf', f'scale={target_width}:{middle_height}:force_original_aspect_ratio=decrease,'
-                       f'pad={target_width}:{middle_height}:(ow-iw)/2:(oh-ih)/2:color=black,'
-                       f'pad={target_width}:{target_height}:0:{top_bar_height}:color=black,'
-                       f'drawtext=text=\'Part {i+1}\':fontfile={font_path}:fontsize=80:'
-                       f'x=(w-tw)/2:y=(h-th)/10:fontcolor=white:shadowcolor=white:shadowx=3:shadowy=3',
+                'ffmpeg', '-ss', str(start_time), '-i', video_path, '-loop', '1', '-i', title_frame,
+                '-t', str(part_duration_actual),
+                '-filter_complex', build_overlay_filter(target_width, top_bar_height, middle_height, 'dark_glow'),
+                '-map', '[v]', '-map', '0:a:0?',
                 '-c:v', 'libx264', '-preset', 'veryslow', '-crf', '16', '-tune', 'film',
-                '-pix_fmt', video_info['pix_fmt'], '-b:v', f'{target_bitrate}',
+                '-pix_fmt', video_info.pix_fmt, '-b:v', f'{target_bitrate}',
                 '-maxrate', f'{int(target_bitrate * 1.5)}', '-bufsize', f'{int(target_bitrate * 2)}',
                 '-x264-params', 'ref=6:me=umh:subq=9:trellis=2:8x8dct=1',
                 '-c:a', 'aac', '-b:a', '320k', '-movflags', '+faststart',
                 '-avoid_negative_ts', 'make_zero', '-fflags', '+genpts', '-y', output_path
             ]
             
-            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            await asyncio.to_thread(subprocess.run, cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
             
             # Send part
             with open(output_path, 'rb') as video_file:
@@ -138,6 +121,7 @@ async def process_video(video_path, message_id, part_duration=15):
         raise e
     finally:
         if os.path.exists(video_path):
+            forget_media(video_path)
             os.remove(video_path)
 
 # Bot runner
@@ -225,9 +209,22 @@ def upload_chunk():
     upload_id = request.form.get('upload_id')
     chunk_index = request.form.get('chunk_index')
     chunk_file = os.path.join(app.config['CHUNKS_FOLDER'], upload_id, f"chunk_{chunk_index}")
-    request.files.get('chunk').save(chunk_file)
+    # Saved under a temporary name so an interrupted chunk never counts as received
+    request.files.get('chunk').save(f"{chunk_file}.part")
+    os.replace(f"{chunk_file}.part", chunk_file)
     return jsonify({"success": True})
 
+# Chunks the server already has, so a client can resume and send only the rest
+@app.route('/upload_status')
+def upload_status():
+    upload_id = request.args.get('upload_id', '')
+    upload_dir = os.path.join(app.config['CHUNKS_FOLDER'], secure_filename(upload_id))
+    if not upload_id or not os.path.isdir(upload_dir):
+        return jsonify({"error": "Unknown upload ID"}), 404
+    received = sorted(int(name.split('_')[1]) for name in os.listdir(upload_dir)
+                      if name.startswith('chunk_') and not name.endswith('.part'))
+    return jsonify({"upload_id": upload_id, "received": received})
+
 @app.route('/complete_upload', methods=['POST'])
 def complete_upload():
     if not bot_ready:
@@ -240,7 +237,8 @@ def complete_upload():
     # Combine chunks
     video_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file_name))
     with open(video_path, 'wb') as outfile:
-        for chunk_file in sorted(os.listdir(upload_dir), key=lambda x: int(x.split('_')[1])):
+        for chunk_file in sorted((name for name in os.listdir(upload_dir) if not name.endswith('.part')),
+                                key=lambda x: int(x.split('_')[1])):
             with open(os.path.join(upload_dir, chunk_file), 'rb') as infile:
                 outfile.write(infile.read())
     
@@ -741,6 +739,9 @@ with open('templates/index.html', 'w') as f:
                 }
             }
             
+            const PARALLEL_UPLOADS = 4;
+            const MAX_CHUNK_ATTEMPTS = 5;
+            
             async function uploadFile(file) {
                 const chunkSize = 5 * 1024 * 1024; // 5MB chunks
                 const totalChunks = Math.ceil(file.size / chunkSize);
@@ -750,43 +751,83 @@ with open('templates/index.html', 'w') as f:
                 statusDiv.style.display = 'none';
                 
                 try {
-                    // Initialize upload
-                    const initResponse = await fetch('/init_upload', { method: 'POST' });
-                    const initData = await initResponse.json();
-                    
-                    if (initData.error) {
-                        throw new Error(initData.error);
+                    // Resume an interrupted upload of the same file, else start a new one
+                    const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+                    let uploadId = localStorage.getItem(resumeKey);
+                    let received = new Set();
+                    if (uploadId) {
+                        const statusResponse = await fetch(`/upload_status?upload_id=${encodeURIComponent(uploadId)}`);
+                        if (statusResponse.ok) {
+                            received = new Set((await statusResponse.json()).received);
+                        } else {
+                            uploadId = null;
+                        }
                     }
                     
-                    const uploadId = initData.upload_id;
-                    
-                    // Upload chunks
-                    for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
-                        const start = chunkIndex * chunkSize;
-                        const end = Math.min(file.size, start + chunkSize);
-                        const chunk = file.slice(start, end);
+                    if (!uploadId) {
+                        const initResponse = await fetch('/init_upload', { method: 'POST' });
                         
-                        const formData = new FormData();
-                        formData.append('upload_id', uploadId);
-                        formData.append('chunk_index', chunkIndex);
-                        formData.append('chunk', chunk);
+                        const initData = await initResponse.json();
                         
-                        const progress = Math.round(((chunkIndex + 1) / totalChunks) * 100);
-                        progressBar.style.width = progress + '%';
-                        progressText.textContent = progress + '%';
-                        
-                        const response = await fetch('/upload_chunk', {
-                            method: 'POST',
-                            body: formData
-                        });
-                        
-                        const data = await response.json();
+                        if (initData.error) {
+                            throw new Error(initData.error);
+                        }
                         
-                        if (data.error) {
-                            throw new Error(data.error);
+                        uploadId = initData.upload_id;
+                        localStorage.setItem(resumeKey, uploadId);
+                    }
+                    
+                    // Upload the missing chunks, PARALLEL_UPLOADS at a time
+                    const pending = [];
+                    for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
+                        if (!received.has(chunkIndex)) {
+                            pending.push(chunkIndex);
+                        }
+                    }
+                    let uploaded = totalChunks - pending.length;
+                    
+                    // A failed chunk is retried with backoff instead of restarting the upload
+                    async function uploadChunk(chunkIndex) {
+                        const start = chunkIndex * chunkSize;
+                        const chunk = file.slice(start, Math.min(file.size, start + chunkSize));
+                        for (let attempt = 1; ; attempt++) {
+                            try {
+                                const formData = new FormData();
+                                formData.append('upload_id', uploadId);
+                                formData.append('chunk_index', chunkIndex);
+                                formData.append('chunk', chunk);
+                                
+                                const response = await fetch('/upload_chunk', {
+                                    method: 'POST',
+                                    body: formData
+                                });
+                                const data = await response.json();
+                                
+                                if (data.error) {
+                                    throw new Error(data.error);
+                                }
+                                return;
+                            } catch (error) {
+                                if (attempt >= MAX_CHUNK_ATTEMPTS) {
+                                    throw error;
+                                }
+                                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+                            }
                         }
                     }
                     
+                    async function uploadWorker() {
+                        while (pending.length > 0) {
+                            await uploadChunk(pending.shift());
+                            uploaded++;
+                            const progress = Math.round((uploaded / totalChunks) * 100);
+                            progressBar.style.width = progress + '%';
+                            progressText.textContent = progress + '%';
+                        }
+                    }
+                    
+                    await Promise.all(Array.from({ length: PARALLEL_UPLOADS }, uploadWorker));
+                    
                     // Complete upload
                     const completeFormData = new FormData();
                     completeFormData.append('upload_id', uploadId);
@@ -802,6 +843,7 @@ with open('templates/index.html', 'w') as f:
                     if (completeData.error) {
                         throw new Error(completeData.error);
                     }
+                    localStorage.removeItem(resumeKey);
                     
                     showStatus(completeData.message, true);
                     resetUpload();
@@ -1,7 +1,6 @@
 import os
 import subprocess
 import math
-import json
 import asyncio
 import telebot
 from telebot.async_telebot import AsyncTeleBot
@@ -12,6 +11,8 @@ import threading
 import time
 import uuid
 import shutil
+from media_probe import probe_media, forget_media
+from title_overlays import render_title_frame, build_overlay_filter
 
 # Configuration
 apihelper.TIMEOUT = 600
@@ -51,28 +52,9 @@ async def process_video(video_path, message_id):
         output_folder = f"video_parts_{message_id}"
         os.makedirs(output_folder, exist_ok=True)
         
-        # Get video info
-        def get_video_info(video_path):
-            cmd = [
-                'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-                '-show_entries', 'stream=duration,r_frame_rate,width,height,bit_rate,pix_fmt',
-                '-show_entries', 'format=duration,bit_rate', '-of', 'json', video_path
-            ]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            info = json.loads(result.stdout)
-            
-            video_stream = info['streams'][0]
-            return {
-                'duration': float(info['format']['duration']),
-                'fps': eval(video_stream['r_frame_rate']),
-                'width': int(video_stream['width']),
-                'height': int(video_stream['height']),
-                'bit_rate': video_stream.get('bit_rate') or info['format'].get('bit_rate'),
-                'pix_fmt': video_stream.get('pix_fmt', 'yuv420p')
-            }
-        
-        video_info = get_video_info(video_path)
-        duration = video_info['duration']
+        # Get video info (cached per file)
+        video_info = await asyncio.to_thread(probe_media, video_path)
+        duration = video_info.duration
         num_parts = math.ceil(duration / 15)
         
         # Target dimensions
@@ -101,24 +83,25 @@ async def process_video(video_path, message_id):
                 continue
                 
             output_path = os.path.join(output_folder, f"part_{i+1}.mp4")
-            target_bitrate = int(video_info['bit_rate']) if video_info['bit_rate'] else 8000000
+            target_bitrate = video_info.bit_rate or 8000000
+            
+            # Black bars with the part label, rendered once and reused across runs
+            title_frame = await asyncio.to_thread(render_title_frame, f'Part {i+1}', font_path, target_width, target_height, style='dark_glow')
             
             # FFmpeg command
             cmd = [
-                'ffmpeg', '-ss', str(start_time), '-i', video_path, '-t', str(part_duration),
-                '-vf', f'scale={target_width}:{middle_height}:force_original_aspect_ratio=decrease,'
-                       f'pad={target_width}:{middle_height}:(ow-iw)/2:(oh-ih)/2:color=black,'
-                       f'pad={target_width}:{target_height}:0:{top_bar_height}:color=black,'
-                       f'drawtext=text=\'Part {i+1}\':fontfile={font_path}:fontsize=80:'
-                       f'x=(w-tw)/2:y=(h-th)/10:fontcolor=white:shadowcolor=white:shadowx=3:shadowy=3',
+                'ffmpeg', '-ss', str(start_time), '-i', video_path, '-loop', '1', '-i', title_frame,
+                '-t', str(part_duration),
+                '-filter_complex', build_overlay_filter(target_width, top_bar_height, middle_height, 'dark_glow'),
+                '-map', '[v]', '-map', '0:a:0?',
                 '-c:v', 'libx264', '-preset', 'slow', '-crf', '18',
-                '-pix_fmt', video_info['pix_fmt'], '-b:v', f'{target_bitrate}',
+                '-pix_fmt', video_info.pix_fmt, '-b:v', f'{target_bitrate}',
                 '-maxrate', f'{int(target_bitrate * 1.5)}', '-bufsize', f'{int(target_bitrate * 2)}',
                 '-c:a', 'aac', '-b:a', '320k', '-movflags', '+faststart',
                 '-avoid_negative_ts', 'make_zero', '-fflags', '+genpts', '-y', output_path
             ]
             
-            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            await asyncio.to_thread(subprocess.run, cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
             
             # Send part
             with open(output_path, 'rb') as video_file:
@@ -135,6 +118,7 @@ async def process_video(video_path, message_id):
         raise e
     finally:
         if os.path.exists(video_path):
+            forget_media(video_path)
             os.remove(video_path)
 
 # Bot runner
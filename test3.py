@@ -1,29 +1,48 @@
 import os
 import subprocess
 import math
-import json
 import asyncio
 import telebot
 from telebot.async_telebot import AsyncTeleBot
 from telebot import apihelper
+from telebot.asyncio_helper import ApiTelegramException
 from flask import Flask, request, render_template, jsonify
 from werkzeug.utils import secure_filename
 import threading
 import time
 import uuid
 import shutil
+import functools
+import bisect
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ffmpeg_encoders import ENCODER_PREFERENCE, probe_capabilities, select_encoders, run_with_encoder_fallback
+from encoding_profiles import PROFILES, DEFAULT_PROFILE, profile_video_args, record_throughput, describe_profiles
+from encoding_profiles import profile_preset, with_x264_preset, pick_preset_for_deadline
+from title_overlays import render_title_frame, write_title_sequence, build_multi_overlay_filter
+from title_overlays import OUTPUT_LAYOUTS, layout_fontsize
+from cpu_scheduler import CPU_BUDGET, run_scheduled, budget_status, ffmpeg_thread_args
+from media_probe import probe_media, get_keyframe_times, forget_media
+from part_cache import file_digest, job_cache_key, lookup_parts, begin_parts, stage_part, commit_parts, discard_parts
+from part_cache import cache_status, lookup_file_ids, record_file_ids, forget_file_ids
+from mp4_index import NotFaststart, read_moov, parse_moov, byte_range_for_time
+from async_server import STREAM_BLOCK_SIZE, run_async_server, stream_part, stream_body
+from aiohttp import web
 
 # Configuration
 apihelper.TIMEOUT = 600
 TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', "8396391757:AAFS0YHU0YniXvOxrocNab2uAeY56Cu4GKA")
 CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', "898142325")
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+SERVER_MODE = os.environ.get('SERVER_MODE', 'flask')  # 'async' serves on aiohttp instead of Flask's dev server
 
 # App initialization
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['CHUNKS_FOLDER'] = 'chunks'
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB chunks
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # Default for preallocated uploads
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['CHUNKS_FOLDER'], exist_ok=True)
 
@@ -33,11 +52,48 @@ bot_ready = False
 bot_event_loop = None
 current_chat_id = CHAT_ID
 current_part_duration = 15  # Default duration in seconds
+current_processing_mode = 'segment'  # 'segment' (single ffmpeg pass) or 'per_part'
+current_show_label = True  # False delivers plain keyframe cuts without re-encoding
+current_encoder_preference = list(ENCODER_PREFERENCE)
+current_profile = DEFAULT_PROFILE
+current_deadline = None  # Seconds to deliver all parts in, or None for no budget
+current_output_layouts = ['vertical']  # Keys of OUTPUT_LAYOUTS, rendered from one decode
+PROCESSING_MODES = ('segment', 'per_part', 'copy', 'smart')
+
+# Part encoder pool, shared by all jobs. Every ffmpeg also holds its thread count
+# from the global CPU budget, so concurrent jobs queue instead of oversubscribing
+PART_ENCODE_WORKERS = int(os.environ.get('PART_ENCODE_WORKERS', max(1, CPU_BUDGET // 4)))
+part_encode_executor = ThreadPoolExecutor(max_workers=PART_ENCODE_WORKERS)
+SINGLE_PASS_THREADS = int(os.environ.get('SINGLE_PASS_THREADS', max(1, CPU_BUDGET // 2)))
+
+# Encoded parts waiting for upload; a full queue pauses the encode stage
+DELIVERY_QUEUE_SIZE = int(os.environ.get('DELIVERY_QUEUE_SIZE', 2))
 
 # Job status tracking
 job_status = {}
 job_status_lock = threading.Lock()
 
+# Upload sessions: a running SHA-256 of the chunks received so far, in file order
+upload_sessions = {}
+upload_sessions_lock = threading.Lock()
+
+# Faststart MP4 uploads start encoding once the first part's bytes are in, and
+# give up if no chunk arrives for UPLOAD_STALL_TIMEOUT seconds
+EARLY_START = os.environ.get('EARLY_START', '1') != '0'
+UPLOAD_STALL_TIMEOUT = float(os.environ.get('UPLOAD_STALL_TIMEOUT', 600))
+
+# Largest file /init_upload will preallocate, and how long an upload may sit idle
+# before its session, digest and partial file are dropped
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 8 * 1024 ** 3))
+UPLOAD_SESSION_TTL = float(os.environ.get('UPLOAD_SESSION_TTL', 6 * 3600))
+
+# Event loop lag: how late the monitor's sleep wakes up. Media subprocesses run in
+# threads, so this should stay in the low milliseconds while encodes run
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_WARN = float(os.environ.get('LOOP_LAG_WARN', 0.25))
+loop_lag_samples = deque(maxlen=600)  # About the last minute
+loop_lag_max = 0.0
+
 # Check FFmpeg
 def check_ffmpeg():
     try:
@@ -51,9 +107,107 @@ if not check_ffmpeg():
     print("Error: FFmpeg not installed. Please install FFmpeg to continue.")
     exit(1)
 
+# Probe encoders once per host (cached on disk)
+print(f"Available encoders: {', '.join(probe_capabilities()['encoders']) or 'none'}")
+
+# Copy-mode cut points: the keyframe nearest to each part boundary
+def plan_keyframe_cuts(keyframe_times, duration, part_duration):
+    cut_points = []
+    boundary = part_duration
+    while boundary < duration:
+        pos = bisect.bisect_left(keyframe_times, boundary)
+        candidates = keyframe_times[max(pos - 1, 0):pos + 1]
+        if candidates:
+            nearest = min(candidates, key=lambda t: abs(t - boundary))
+            if 0 < nearest < duration and (not cut_points or nearest > cut_points[-1]):
+                cut_points.append(nearest)
+        boundary += part_duration
+    return cut_points
+
+# x264 -profile:v names for the H.264 profiles ffprobe reports
+X264_PROFILES = {'Constrained Baseline': 'baseline', 'Baseline': 'baseline', 'Main': 'main', 'High': 'high',
+                 'High 10': 'high10', 'High 4:2:2': 'high422', 'High 4:4:4 Predictive': 'high444'}
+
+# Smart-render boundary fragments: libx264 at the source's profile, level and pixel
+# format, with SPS/PPS repeated in-band. The fragments are joined as MPEG-TS
+# (Annex-B), so every GOP, copied or re-encoded, carries the parameter sets it
+# was coded with instead of relying on the one avcC of the joined mp4.
+def smart_fragment_args(video_info, preset, bitrate_args):
+    args = ['-c:v', 'libx264', '-preset', preset, '-pix_fmt', video_info.pix_fmt]
+    if video_info.profile in X264_PROFILES:
+        args += ['-profile:v', X264_PROFILES[video_info.profile]]
+    if video_info.level and video_info.level > 0:
+        args += ['-level', str(video_info.level)]
+    return [*args, '-x264-params', 'repeat-headers=1', *bitrate_args]
+
+# Smart render: re-encode only the frames between each boundary and the nearest
+# keyframe inside the part, stream-copy the whole GOPs in between and join them
+def smart_render_part(video_path, output_path, start_time, end_time, keyframe_times,
+                      fragment_codec_args, audio_path, audio_codec_args, threads=1):
+    work_dir = f"{output_path}.fragments"
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        inner_keyframes = keyframe_times[bisect.bisect_left(keyframe_times, start_time):
+                                         bisect.bisect_left(keyframe_times, end_time)]
+        fragments = []
+        
+        def add_fragment(frag_start, frag_end, copy):
+            if frag_end - frag_start < 0.01:
+                return
+            fragment_path = os.path.join(work_dir, f"fragment_{len(fragments)}.ts")
+            
+            if copy:
+                # Seek just past the keyframe so the copy starts exactly on it, and stop
+                # just short of frag_end so the keyframe there is left to the next fragment
+                codec_args = ['-ss', f'{frag_start + 0.001:.6f}', '-i', video_path,
+                              '-t', f'{frag_end - frag_start - 0.002:.6f}', '-c:v', 'copy']
+            else:
+                codec_args = [*ffmpeg_thread_args(threads), '-ss', f'{frag_start:.6f}', '-i', video_path,
+                              '-t', f'{frag_end - frag_start:.6f}', *fragment_codec_args, '-threads', str(threads)]
+            cmd = ['ffmpeg', *codec_args, '-map', '0:v:0', '-an',
+                   '-avoid_negative_ts', 'make_zero', '-f', 'mpegts', '-y', fragment_path]
+            run_scheduled(cmd, 1 if copy else threads, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            fragments.append(fragment_path)
+        
+        if not inner_keyframes:
+            add_fragment(start_time, end_time, copy=False)
+        else:
+            add_fragment(start_time, inner_keyframes[0], copy=False)
+            add_fragment(inner_keyframes[0], inner_keyframes[-1], copy=True)
+            add_fragment(inner_keyframes[-1], end_time, copy=False)
+        
+        list_path = os.path.join(work_dir, 'fragments.txt')
+        with open(list_path, 'w') as f:
+            for fragment_path in fragments:
+                f.write(f"file '{os.path.abspath(fragment_path)}'\n")
+        
+        # Join the video fragments and cut the audio for the exact same range
+        cmd = [
+            'ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path,
+            *ffmpeg_thread_args(1), '-ss', f'{start_time:.6f}', '-t', f'{end_time - start_time:.6f}', '-i', audio_path,
+            '-map', '0:v:0', '-map', '1:a:0?', '-c:v', 'copy', *audio_codec_args, '-threads', '1',
+            '-movflags', '+faststart', '-y', output_path
+        ]
+        run_scheduled(cmd, 1, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# Job audio track, encoded once (or copied when it is already AAC) so parts can
+# slice it with -c:a copy instead of re-encoding it at every boundary
+def prepare_job_audio(video_path, audio_path, audio_codec_name, audio_codec_args):
+    codec_args = ['-c:a', 'copy'] if audio_codec_name == 'aac' else audio_codec_args
+    cmd = ['ffmpeg', *ffmpeg_thread_args(1), '-i', video_path, '-map', '0:a:0', '-vn', *codec_args,
+           '-threads', '1', '-y', audio_path]
+    run_scheduled(cmd, 1, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
 # Video processing
-async def process_video(video_path, message_id, part_duration=15):
+async def process_video(video_path, message_id, part_duration=15, processing_mode='segment', show_label=True,
+                        encoder_preference=None, profile=DEFAULT_PROFILE, deadline=None, output_layouts=None,
+                        content_hash=None, upload=None):
     job_id = str(message_id)
+    job_started = time.time()
+    delivery_task = None
+    part_stage = None
     try:
         with job_status_lock:
             job_status[job_id] = {"status": "processing", "message": "Processing started"}
@@ -61,36 +215,35 @@ async def process_video(video_path, message_id, part_duration=15):
         output_folder = f"video_parts_{message_id}"
         os.makedirs(output_folder, exist_ok=True)
         
-        # Get video info
-        def get_video_info(video_path):
-            cmd = [
-                'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-                '-show_entries', 'stream=duration,r_frame_rate,width,height,bit_rate,pix_fmt',
-                '-show_entries', 'format=duration,bit_rate', '-of', 'json', video_path
-            ]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            info = json.loads(result.stdout)
-            
-            video_stream = info['streams'][0]
-            return {
-                'duration': float(info['format']['duration']),
-                'fps': eval(video_stream['r_frame_rate']),
-                'width': int(video_stream['width']),
-                'height': int(video_stream['height']),
-                'bit_rate': video_stream.get('bit_rate') or info['format'].get('bit_rate'),
-                'pix_fmt': video_stream.get('pix_fmt', 'yuv420p')
-            }
+        # Started from an upload that is still arriving: reads of the file wait
+        # until the chunks they need are in
+        streaming = upload is not None and not upload['complete']
+        
+        async def wait_for_upload(ready):
+            last_received, last_progress = None, time.time()
+            while not ready():
+                received = len(upload['received'])
+                if received != last_received:
+                    last_received, last_progress = received, time.time()
+                elif time.time() - last_progress > UPLOAD_STALL_TIMEOUT:
+                    raise RuntimeError(f"Upload stalled for {UPLOAD_STALL_TIMEOUT:.0f}s")
+                await asyncio.sleep(0.5)
+        
+        def time_range_ready(start_time, end_time):
+            return upload_has_range(upload, *byte_range_for_time(upload['tracks'], start_time, end_time))
         
-        video_info = get_video_info(video_path)
-        duration = video_info['duration']
+        if streaming:
+            # ffprobe reads the moov and the first packets
+            await wait_for_upload(functools.partial(time_range_ready, 0, part_duration))
+        
+        # Get video info
+        video_info = await asyncio.to_thread(probe_media, video_path)
+        duration = video_info.duration
         num_parts = math.ceil(duration / part_duration)
         
-        # Target dimensions
-        target_width = 1080
-        target_height = 1920
-        top_bar_height = int(target_height * 0.2)
-        bottom_bar_height = int(target_height * 0.2)
-        middle_height = target_height - top_bar_height - bottom_bar_height
+        # Target layouts, 1080x1920 'vertical' unless the job asks for more
+        output_layouts = [layout for layout in output_layouts or [] if layout in OUTPUT_LAYOUTS] or ['vertical']
+        target_width, target_height = OUTPUT_LAYOUTS['vertical']
         
         # Font path
         font_path = next((path for path in [
@@ -99,46 +252,434 @@ async def process_video(video_path, message_id, part_duration=15):
             "/usr/share/fonts/truetype/freefont/FreeSansBold.ttf"
         ] if os.path.exists(path)), "arial")
         
-        await bot.send_message(current_chat_id, f"🎬 Processing video... Found {num_parts} parts. Preserving original quality.")
+        # The deadline tuner adapts the preset between separate part encodes
+        if deadline and processing_mode == 'segment':
+            processing_mode = 'per_part'
         
-        # Process each part
-        for i in range(num_parts):
-            start_time = i * part_duration
-            end_time = min((i + 1) * part_duration, duration)
-            part_duration_actual = end_time - start_time
-            
-            if part_duration_actual < 0.1:
-                continue
+        # Separate part encodes can start while the upload is still arriving
+        if streaming and processing_mode == 'segment':
+            processing_mode = 'per_part'
+        
+        # Smart rendering joins re-encoded and copied H.264 fragments, so it needs
+        # libx264 to match the source stream
+        if processing_mode == 'smart' and (video_info.codec_name != 'h264'
+                                           or 'libx264' not in probe_capabilities()['encoders']):
+            processing_mode = 'copy'
+        
+        # Nothing to re-render: no label, or the source already has the target layout
+        if processing_mode != 'smart' and (not show_label or (
+                output_layouts == ['vertical'] and (video_info.width, video_info.height) == (target_width, target_height))):
+            processing_mode = 'copy'
+        
+        # Only the overlay modes render layouts; copy and smart keep the source frame
+        if processing_mode in ('segment', 'per_part'):
+            for layout in output_layouts:
+                os.makedirs(os.path.join(output_folder, layout), exist_ok=True)
+        else:
+            output_layouts = []
+        
+        # The other modes read the whole file
+        if streaming and processing_mode != 'per_part':
+            await wait_for_upload(lambda: upload['complete'])
+            streaming = False
+        
+        if processing_mode == 'copy':
+            cut_points = plan_keyframe_cuts(await asyncio.to_thread(get_keyframe_times, video_path), duration, part_duration)
+            num_parts = len(cut_points) + 1
+        
+        encoders = select_encoders(encoder_preference)
+        
+        # Same content and settings as an earlier job: re-send its Telegram file_ids,
+        # or else deliver its cached parts. Otherwise this job's parts are staged
+        # for the cache as they are sent. A streaming job has no content hash
+        # until the upload completes, so it skips the lookups
+        cache_settings = {
+            'processing_mode': processing_mode, 'part_duration': part_duration, 'profile': profile,
+            'deadline': deadline, 'encoders': encoders, 'font_path': font_path,
+            'layouts': {layout: OUTPUT_LAYOUTS[layout] for layout in output_layouts}
+        }
+        cache_key = None
+        if not streaming:
+            if upload:
+                content_hash = upload['content_hash']
+            if not content_hash:
+                content_hash = await asyncio.to_thread(file_digest, video_path)
+            cache_key = job_cache_key(content_hash, cache_settings)
+        
+        async def send_by_file_id(files):
+            for file_id, caption in files:
+                await bot.send_video(current_chat_id, file_id, caption=caption)
+        
+        cached_parts = None
+        sent_parts = await asyncio.to_thread(lookup_file_ids, cache_key) if cache_key else None
+        if sent_parts:
+            await bot.send_message(current_chat_id, f"♻️ Already sent with these settings, forwarding {len(sent_parts)} parts.")
+            # A file_id belongs to the bot that uploaded it. Only the first file is
+            # tried before committing, so a rejected id (Telegram's 400) falls back to
+            # uploading the parts again without having sent any of them twice
+            try:
+                await send_by_file_id(sent_parts[0][1][:1])
+            except ApiTelegramException as e:
+                if e.error_code != 400:
+                    raise
+                print(f"Job {job_id}: stored file_id rejected, uploading instead: {e}")
+                await asyncio.to_thread(forget_file_ids, cache_key)
+                sent_parts = None
+        if not sent_parts:
+            cached_parts = await asyncio.to_thread(lookup_parts, cache_key, output_folder) if cache_key else None
+            if cached_parts:
+                await bot.send_message(current_chat_id, f"♻️ Already processed with these settings, sending {num_parts} cached parts.")
+            else:
+                part_stage = await asyncio.to_thread(begin_parts, cache_key or f"upload-{job_id}")
+                await bot.send_message(current_chat_id, f"🎬 Processing video... Found {num_parts} parts. Preserving original quality.")
+        
+        # Encoder settings shared by the re-encoding modes
+        target_bitrate = video_info.bit_rate or 8000000
+        bitrate_args = [
+            '-b:v', f'{target_bitrate}',
+            '-maxrate', f'{int(target_bitrate * 1.5)}', '-bufsize', f'{int(target_bitrate * 2)}'
+        ]
+        
+        def video_codec_args(encoder, preset=None):
+            args = profile_video_args(profile, encoder)
+            if args[1] == 'libx264':
+                if preset:
+                    args = with_x264_preset(args, preset)
+                args += ['-pix_fmt', video_info.pix_fmt]
+            return [*args, *bitrate_args]
+        
+        # Deadline tuning: the last x264 preset used and the realtime factor it achieved
+        tuning = {'preset': profile_preset(profile), 'speed': None, 'first_part_done': False}
+        
+        def next_preset(start_time):
+            if not deadline or tuning['speed'] is None:
+                return None
+            preset = pick_preset_for_deadline(
+                tuning['preset'], tuning['speed'], duration - start_time,
+                deadline - (time.time() - job_started), PART_ENCODE_WORKERS, profile_preset(profile))
+            if preset != tuning['preset']:
+                print(f"Job {job_id}: switching x264 preset {tuning['preset']} -> {preset} to meet the {deadline}s deadline")
+            return preset
+        
+        # Time an encode and fold its fps and bytes/s into the profile's measurements.
+        # Throughput uses ffmpeg's own run time, not the wait for cores or failed encoders
+        def measured(encode, output_paths, media_seconds, preset=None):
+            def run():
+                started = time.time()
+                run_stats = {}
+                encoder = encode(stats=run_stats)
+                elapsed = time.time() - started
+                run_elapsed = run_stats.get('elapsed', elapsed)
+                output_bytes = sum(delivered_bytes.get(path) or (os.path.getsize(path) if os.path.exists(path) else 0)
+                                   for path in output_paths())
+                record_throughput(profile, encoder, media_seconds * video_info.fps,
+                                  run_elapsed, output_bytes, media_seconds)
+                # The deadline tuner projects encode speed, so queueing must not count
+                if encoder == 'libx264' and run_elapsed > 0:
+                    tuning['preset'] = preset or profile_preset(profile)
+                    tuning['speed'] = media_seconds / run_elapsed
+                tuning['first_part_done'] = True
+                return encoder
+            return run
+        
+        audio_codec_args = ['-c:a', 'aac', '-b:a', '320k']
+        
+        # Per-part modes slice one job-wide audio track, unless the rest of the
+        # audio is still uploading
+        job_audio_path = None
+        if not (sent_parts or cached_parts or streaming) and processing_mode in ('per_part', 'smart') \
+                and video_info.audio_codec_name:
+            job_audio_path = os.path.join(output_folder, 'audio.m4a')
+            await asyncio.to_thread(prepare_job_audio, video_path, job_audio_path,
+                                    video_info.audio_codec_name, audio_codec_args)
+        
+        # Output file of part i, per layout for the overlay modes
+        def part_paths(i):
+            if not output_layouts:
+                return [os.path.join(output_folder, f"part_{i+1}.mp4")]
+            return [os.path.join(output_folder, layout, f"part_{i+1}.mp4") for layout in output_layouts]
+        
+        # Title frame inputs (one per layout) for part i
+        def title_frame(layout, i):
+            width, height = OUTPUT_LAYOUTS[layout]
+            return render_title_frame(f'Part {i+1}', font_path, width, height, fontsize=layout_fontsize(height))
+        
+        # Send part
+        delivered_bytes = {}
+        
+        sent_files = []
+        
+        async def deliver_part(i, output_paths, source='encoded'):
+            if source == 'file_id':
+                await send_by_file_id(output_paths)
+                await asyncio.sleep(1)
+                return
+            if part_stage:
+                await asyncio.to_thread(stage_part, part_stage, i, output_paths, output_folder)
+            files = []
+            for output_path in output_paths:
+                caption = f"Part {i+1}/{num_parts}"
+                if len(output_layouts) > 1:
+                    caption += f" ({os.path.basename(os.path.dirname(output_path))})"
+                with open(output_path, 'rb') as video_file:
+                    message = await bot.send_video(current_chat_id, video_file, caption=caption)
+                files.append([(message.video or message.document).file_id, caption])
                 
-            output_path = os.path.join(output_folder, f"part_{i+1}.mp4")
-            target_bitrate = int(video_info['bit_rate']) if video_info['bit_rate'] else 8000000
-            
-            # Enhanced FFmpeg command with advanced settings
+                # Cached parts are the job's own links to the cache entry
+                delivered_bytes[output_path] = os.path.getsize(output_path)
+                os.remove(output_path)
+            sent_files.append((i, files))
+            await asyncio.sleep(1)
+        
+        # Delivery stage: uploads parts in order while the encode stage works ahead
+        delivery_queue = asyncio.Queue(maxsize=DELIVERY_QUEUE_SIZE)
+        
+        async def delivery_stage():
+            while True:
+                item = await delivery_queue.get()
+                if item is None:
+                    return
+                await deliver_part(*item)
+        
+        delivery_task = asyncio.create_task(delivery_stage())
+        
+        # Queue a finished part; raises if the delivery stage has failed
+        async def hand_off(item):
+            put = asyncio.ensure_future(delivery_queue.put(item))
+            await asyncio.wait([put, delivery_task], return_when=asyncio.FIRST_COMPLETED)
+            if not put.done():
+                put.cancel()
+            if delivery_task.done():
+                delivery_task.result()
+        
+        # Run a segment muxer encode in a thread and hand off each part as soon as
+        # every segment list has it, so uploads start before the encode finishes
+        segments_handed_off = [0]
+        
+        async def segment_and_deliver(encode, list_paths):
+            encode_future = asyncio.ensure_future(asyncio.to_thread(encode))
+            try:
+                await deliver_segments(encode_future, list_paths)
+            finally:
+                # A failed delivery leaves ffmpeg running; let it finish before cleanup
+                if not encode_future.done():
+                    await asyncio.wait([encode_future])
+        
+        async def deliver_segments(encode_future, list_paths):
+            next_part = 0
+            while True:
+                finished = encode_future.done()
+                # Only a successful encode releases every part on disk. After a failure
+                # the segment being written, and any never listed, may be truncated,
+                # so only listed parts are handed off before the error is raised
+                ready = num_parts
+                if not finished or encode_future.exception() is not None:
+                    for list_path in list_paths:
+                        try:
+                            with open(list_path) as f:
+                                ready = min(ready, sum(1 for line in f if line.strip()))
+                        except FileNotFoundError:
+                            ready = 0
+                while next_part < ready:
+                    output_paths = [path for path in part_paths(next_part) if os.path.exists(path)]
+                    if output_paths:
+                        await hand_off((next_part, output_paths))
+                        segments_handed_off[0] += 1
+                    next_part += 1
+                if finished:
+                    await encode_future
+                    return
+                await asyncio.wait([encode_future], timeout=0.5)
+        
+        # Part time ranges, skipping slivers too short to send
+        def iter_part_ranges():
+            for i in range(num_parts):
+                start_time = i * part_duration
+                end_time = min((i + 1) * part_duration, duration)
+                if end_time - start_time >= 0.1:
+                    yield i, start_time, end_time
+        
+        # Encode parts on the shared pool; the deque is the reorder buffer,
+        # so parts finish in any order but are delivered in sequence
+        threads_per_encode = max(1, CPU_BUDGET // PART_ENCODE_WORKERS)
+        
+        async def encode_in_order(part_jobs, ready=None):
+            pending = deque()
+            try:
+                for i, output_paths, encode in part_jobs:
+                    # Input for part i still uploading: deliver what is encoded, then wait
+                    if ready and not ready(i):
+                        while pending:
+                            i_done, paths_done, work = pending.popleft()
+                            await asyncio.wrap_future(work)
+                            await hand_off((i_done, paths_done))
+                        await wait_for_upload(functools.partial(ready, i))
+                    
+                    pending.append((i, output_paths, part_encode_executor.submit(encode)))
+                    
+                    # Keep at most two parts per worker encoded ahead of delivery; under a
+                    # deadline the first part is timed alone before the rest are planned
+                    if len(pending) >= PART_ENCODE_WORKERS * 2 or (deadline and not tuning['first_part_done']):
+                        i, output_paths, work = pending.popleft()
+                        await asyncio.wrap_future(work)
+                        await hand_off((i, output_paths))
+                
+                while pending:
+                    i, output_paths, work = pending.popleft()
+                    await asyncio.wrap_future(work)
+                    await hand_off((i, output_paths))
+            finally:
+                # Queued encodes are dropped; running ones can't be interrupted, so the
+                # job waits for them before its cleanup deletes the folder they write to
+                running = [asyncio.wrap_future(work) for _, _, work in pending if not work.cancel()]
+                if running:
+                    await asyncio.wait(running)
+        
+        if sent_parts:
+            # The first file was already re-sent above
+            (first, first_files), rest = sent_parts[0], sent_parts[1:]
+            for i, files in ([(first, first_files[1:])] if first_files[1:] else []) + rest:
+                await hand_off((i, files, 'file_id'))
+        elif cached_parts:
+            for i, output_paths in cached_parts:
+                await hand_off((i, output_paths, 'cached'))
+        elif processing_mode == 'copy':
+            # Stream copy: split on the planned keyframes, the codecs are never touched.
+            # Cut times are nudged back so float rounding can't skip to the next keyframe
+            segment_times = ','.join(f'{t - 0.001:.6f}' for t in cut_points)
             cmd = [
-                'ffmpeg', '-ss', str(start_time), '-i', video_path, '-t', str(part_duration_actual),
-                '-vf', f'scale={target_width}:{middle_height}:force_original_aspect_ratio=decrease,'
-                       f'pad={target_width}:{middle_height}:(ow-iw)/2:(oh-ih)/2:color=black,'
-                       f'pad={target_width}:{target_height}:0:{top_bar_height}:color=black,'
-                       f'drawtext=text=\'Part {i+1}\':fontfile={font_path}:fontsize=80:'
-                       f'x=(w-tw)/2:y=(h-th)/10:fontcolor=white:shadowcolor=black:shadowx=4:shadowy=4',
-                '-c:v', 'libx264', '-preset', 'veryslow', '-crf', '16', '-profile:v', 'high',
-                '-pix_fmt', video_info['pix_fmt'], '-b:v', f'{target_bitrate}',
-                '-maxrate', f'{int(target_bitrate * 1.5)}', '-bufsize', f'{int(target_bitrate * 2)}',
-                '-x264-params', 'aq-mode=2:aq-strength=1.5:mbtree=1:rc-lookahead=60:ref=6:me=umh:subq=9:trellis=2:8x8dct=1',
-                '-c:a', 'aac', '-b:a', '320k', '-movflags', '+faststart',
-                '-avoid_negative_ts', 'make_zero', '-fflags', '+genpts', '-y', output_path
+                'ffmpeg', '-i', video_path, '-c', 'copy',
+                '-f', 'segment', *(['-segment_times', segment_times] if cut_points else []),
+                '-segment_start_number', '1', '-reset_timestamps', '1', '-segment_format', 'mp4',
+                '-segment_format_options', 'movflags=+faststart',
+                '-segment_list', os.path.join(output_folder, 'parts.csv'), '-segment_list_type', 'csv',
+                '-avoid_negative_ts', 'make_zero', '-y',
+                os.path.join(output_folder, 'part_%d.mp4')
             ]
             
-            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            await segment_and_deliver(
+                functools.partial(run_scheduled, cmd, 1, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True),
+                [os.path.join(output_folder, 'parts.csv')])
+        elif processing_mode == 'segment':
+            # Single pass: decode and filter once, force keyframes on part
+            # boundaries and let the segment muxer write every part_N.mp4.
+            # The pre-rendered title frames switch every part_duration seconds,
+            # and each requested layout is one more output of the same graph
+            def write_title_lists():
+                return [
+                    write_title_sequence(os.path.join(output_folder, f'titles_{layout}.txt'),
+                                         [title_frame(layout, i) for i in range(num_parts)], part_duration)
+                    for layout in output_layouts
+                ]
             
-            # Send part
-            with open(output_path, 'rb') as video_file:
-                await bot.send_video(current_chat_id, video_file, caption=f"Part {i+1}/{num_parts}")
+            title_lists = await asyncio.to_thread(write_title_lists)
             
-            os.remove(output_path)
-            await asyncio.sleep(1)
+            # The single pass holds SINGLE_PASS_THREADS cores, split across its encoders
+            threads_per_output = max(1, SINGLE_PASS_THREADS // len(output_layouts))
+            
+            def segment_cmd(encoder):
+                # A retry on the next encoder would rewrite part files that are queued
+                # for sending and hard-linked into the cache stage, so once a part has
+                # been handed off a failed pass fails the job instead
+                if segments_handed_off[0]:
+                    raise RuntimeError(f"Single pass failed after {segments_handed_off[0]} parts were sent; "
+                                       f"not retrying with {encoder}")
+                cmd = ['ffmpeg', *ffmpeg_thread_args(SINGLE_PASS_THREADS), '-i', video_path]
+                for title_list in title_lists:
+                    cmd += ['-f', 'concat', '-safe', '0', '-i', title_list]
+                cmd += ['-filter_complex', build_multi_overlay_filter(
+                    [OUTPUT_LAYOUTS[layout] for layout in output_layouts])]
+                for n, layout in enumerate(output_layouts):
+                    cmd += [
+                        '-map', f'[v{n}]', '-map', '0:a:0?',
+                        *video_codec_args(encoder), '-threads', str(threads_per_output),
+                        '-force_key_frames', f'expr:gte(t,n_forced*{part_duration})',
+                        *(['-c:a', 'copy'] if video_info.audio_codec_name == 'aac' else audio_codec_args),
+                        '-f', 'segment', '-segment_time', str(part_duration), '-segment_start_number', '1',
+                        '-reset_timestamps', '1', '-segment_format', 'mp4',
+                        '-segment_format_options', 'movflags=+faststart',
+                        '-segment_list', os.path.join(output_folder, layout, 'parts.csv'), '-segment_list_type', 'csv',
+                        '-avoid_negative_ts', 'make_zero', '-fflags', '+genpts', '-y',
+                        os.path.join(output_folder, layout, 'part_%d.mp4')
+                    ]
+                return cmd
+            
+            await segment_and_deliver(measured(
+                functools.partial(run_with_encoder_fallback, segment_cmd, encoders,
+                                  run=functools.partial(run_scheduled, threads=SINGLE_PASS_THREADS)),
+                lambda: [path for i in range(num_parts) for path in part_paths(i)], duration),
+                [os.path.join(output_folder, layout, 'parts.csv') for layout in output_layouts])
+            
+        elif processing_mode == 'smart':
+            # Frame-accurate trimming: only the fragments around each boundary are encoded
+            keyframe_times = await asyncio.to_thread(get_keyframe_times, video_path)
+            
+            def smart_jobs():
+                for i, start_time, end_time in iter_part_ranges():
+                    output_path = os.path.join(output_folder, f"part_{i+1}.mp4")
+                    yield i, [output_path], functools.partial(
+                        smart_render_part, video_path, output_path, start_time, end_time, keyframe_times,
+                        smart_fragment_args(video_info, profile_preset(profile), bitrate_args),
+                        job_audio_path or video_path,
+                        ['-c:a', 'copy'] if job_audio_path else audio_codec_args, threads_per_encode)
+            
+            await encode_in_order(smart_jobs())
+        else:
+            # Enhanced FFmpeg command with advanced settings; one output per layout
+            def per_part_cmd(i, start_time, end_time, preset, encoder):
+                cmd = ['ffmpeg', *ffmpeg_thread_args(threads_per_encode), '-ss', str(start_time), '-i', video_path]
+                for layout in output_layouts:
+                    cmd += ['-loop', '1', '-i', title_frame(layout, i)]
+                if job_audio_path:
+                    cmd += ['-ss', str(start_time), '-i', job_audio_path]
+                cmd += ['-filter_complex', build_multi_overlay_filter(
+                    [OUTPUT_LAYOUTS[layout] for layout in output_layouts])]
+                if job_audio_path:
+                    audio_args = ['-map', f'{len(output_layouts) + 1}:a:0', '-c:a', 'copy']
+                elif video_info.audio_codec_name:
+                    audio_args = ['-map', '0:a:0', *audio_codec_args]
+                else:
+                    audio_args = []
+                for n, output_path in enumerate(part_paths(i)):
+                    cmd += [
+                        '-t', str(end_time - start_time), '-map', f'[v{n}]', *audio_args,
+                        *video_codec_args(encoder, preset), '-threads', str(threads_per_encode),
+                        '-movflags', '+faststart',
+                        '-avoid_negative_ts', 'make_zero', '-fflags', '+genpts', '-y', output_path
+                    ]
+                return cmd
+            
+            # A part whose encoder fails is retried on the next encoder in the list
+            def per_part_jobs():
+                for i, start_time, end_time in iter_part_ranges():
+                    preset = next_preset(start_time)
+                    yield i, part_paths(i), measured(functools.partial(
+                        run_with_encoder_fallback,
+                        functools.partial(per_part_cmd, i, start_time, end_time, preset), encoders,
+                        run=functools.partial(run_scheduled, threads=threads_per_encode)),
+                        functools.partial(part_paths, i), end_time - start_time, preset)
+            
+            part_ranges = {i: (start_time, end_time) for i, start_time, end_time in iter_part_ranges()}
+            await encode_in_order(per_part_jobs(),
+                                  (lambda i: time_range_ready(*part_ranges[i])) if streaming else None)
+        
+        await hand_off(None)
+        await delivery_task
         
-        os.rmdir(output_folder)
+        # A streaming job's cache key needs the hash of the finished upload
+        if cache_key is None:
+            await wait_for_upload(lambda: upload['complete'])
+            cache_key = job_cache_key(upload['content_hash'], cache_settings)
+            if part_stage:
+                part_stage['key'] = cache_key
+        if part_stage:
+            await asyncio.to_thread(commit_parts, part_stage)
+            part_stage = None
+        if sent_files:
+            await asyncio.to_thread(record_file_ids, cache_key, sent_files)
+        
+        # Also clears the job audio track, title lists and any trailing sliver segment
+        await asyncio.to_thread(shutil.rmtree, output_folder)
         await bot.send_message(current_chat_id, "✅ All parts processed successfully with high quality!")
         
         # Update job status to completed
@@ -146,6 +687,8 @@ async def process_video(video_path, message_id, part_duration=15):
             job_status[job_id] = {"status": "completed", "message": "All parts processed successfully!"}
         
     except Exception as e:
+        if upload is not None:
+            upload['failed'] = True
         await bot.send_message(current_chat_id, f"❌ Error processing video: {str(e)}")
         
         # Update job status to error
@@ -153,9 +696,39 @@ async def process_video(video_path, message_id, part_duration=15):
             job_status[job_id] = {"status": "error", "message": f"Error: {str(e)}"}
         raise e
     finally:
+        if delivery_task and not delivery_task.done():
+            delivery_task.cancel()
+        if part_stage:
+            await asyncio.to_thread(discard_parts, part_stage)
         if os.path.exists(video_path):
+            forget_media(video_path)
             os.remove(video_path)
 
+# Loop lag monitor
+async def monitor_loop_lag():
+    global loop_lag_max
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+        loop_lag_samples.append(lag)
+        loop_lag_max = max(loop_lag_max, lag)
+        if lag > LOOP_LAG_WARN:
+            print(f"Event loop blocked for {lag * 1000:.0f} ms")
+
+def loop_lag_stats():
+    samples = sorted(loop_lag_samples)
+    if not samples:
+        return {'samples': 0}
+    return {
+        'samples': len(samples),
+        'avg_ms': round(sum(samples) / len(samples) * 1000, 2),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+        'max_recent_ms': round(samples[-1] * 1000, 2),
+        'max_ms': round(loop_lag_max * 1000, 2)
+    }
+
 # Bot runner
 def run_bot_event_loop():
     global bot_event_loop, bot_ready
@@ -177,6 +750,7 @@ def run_bot_event_loop():
         print(f"Bot connection test failed: {str(e)}")
         bot_ready = False
     
+    loop.create_task(monitor_loop_lag())
     loop.run_forever()
 
 # Start bot thread
@@ -200,13 +774,26 @@ def bot_status():
     return jsonify({
         'status': bot_ready,
         'chat_id': current_chat_id,
-        'part_duration': current_part_duration
+        'part_duration': current_part_duration,
+        'processing_mode': current_processing_mode,
+        'show_label': current_show_label,
+        'encoder_preference': current_encoder_preference,
+        'available_encoders': probe_capabilities()['encoders'],
+        'profile': current_profile,
+        'profiles': describe_profiles(),
+        'deadline': current_deadline,
+        'output_layouts': current_output_layouts,
+        'available_layouts': {name: f'{w}x{h}' for name, (w, h) in OUTPUT_LAYOUTS.items()},
+        'cpu': budget_status(),
+        'loop_lag': loop_lag_stats(),
+        'part_cache': cache_status()
     })
 
 # Update settings endpoint
 @app.route('/update_settings', methods=['POST'])
 def update_settings():
-    global current_chat_id, current_part_duration
+    global current_chat_id, current_part_duration, current_processing_mode, current_show_label
+    global current_encoder_preference, current_profile, current_deadline, current_output_layouts
     data = request.json
     if 'chat_id' in data:
         current_chat_id = data['chat_id']
@@ -217,8 +804,61 @@ def update_settings():
                 current_part_duration = part_duration
         except ValueError:
             pass
+    if data.get('processing_mode') in PROCESSING_MODES:
+        current_processing_mode = data['processing_mode']
+    show_label = parse_flag(data.get('show_label'))
+    if show_label is not None:
+        current_show_label = show_label
+    if 'encoder_preference' in data:
+        preference = data['encoder_preference']
+        if isinstance(preference, str):
+            preference = preference.split(',')
+        preference = [name.strip() for name in preference if name.strip()]
+        if preference:
+            current_encoder_preference = preference
+    if data.get('profile') in PROFILES:
+        current_profile = data['profile']
+    if 'deadline' in data:
+        try:
+            deadline = float(data['deadline'] or 0)
+            current_deadline = deadline if deadline > 0 else None
+        except ValueError:
+            pass
+    if 'output_layouts' in data:
+        layouts = parse_output_layouts(data['output_layouts'])
+        if layouts:
+            current_output_layouts = layouts
     return jsonify({'success': True})
 
+# An upload may pick its own profile, deadline and layouts; otherwise use the current settings
+def upload_job_settings(form):
+    profile = form.get('profile')
+    if profile not in PROFILES:
+        profile = current_profile
+    try:
+        deadline = float(form.get('deadline') or 0) or current_deadline
+    except ValueError:
+        deadline = current_deadline
+    output_layouts = parse_output_layouts(form.get('output_layouts')) or current_output_layouts
+    return profile, deadline, output_layouts
+
+# Layout list from JSON (list) or form (comma separated) input
+def parse_output_layouts(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return [layout.strip() for layout in value or [] if layout.strip() in OUTPUT_LAYOUTS]
+
+# True/False from a JSON bool or a 'true'/'false'/'1'/'0' string, None for anything else
+def parse_flag(value):
+    if isinstance(value, bool):
+        return value
+    return {'true': True, '1': True, 'false': False, '0': False}.get(str(value).strip().lower())
+
+# Event loop lag endpoint
+@app.route('/loop_lag')
+def loop_lag():
+    return jsonify(loop_lag_stats())
+
 # Job status endpoint
 @app.route('/job_status')
 def job_status_endpoint():
@@ -241,21 +881,363 @@ def init_upload():
     if not bot_ready:
         return jsonify({"error": "Bot not ready"}), 503
     
+    expire_upload_sessions()
     upload_id = str(uuid.uuid4())
-    os.makedirs(os.path.join(app.config['CHUNKS_FOLDER'], upload_id), exist_ok=True)
-    return jsonify({"upload_id": upload_id})
+    session = {'digest': hashlib.sha256(), 'next_chunk': 0, 'lock': threading.Lock(), 'target': None,
+               'touched': time.time()}
+    
+    # Clients that send the total size get a preallocated target file that chunks are
+    # written into at their offsets; others fall back to per-chunk files
+    try:
+        total_size = int(request.form.get('total_size') or 0)
+        chunk_size = int(request.form.get('chunk_size') or UPLOAD_CHUNK_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid total_size or chunk_size"}), 400
+    if total_size > MAX_UPLOAD_SIZE:
+        return jsonify({"error": f"Uploads are limited to {MAX_UPLOAD_SIZE} bytes"}), 413
+    if total_size > 0:
+        if not 0 < chunk_size <= app.config['MAX_CONTENT_LENGTH'] - 64 * 1024:
+            return jsonify({"error": "Invalid chunk_size"}), 400
+        target = os.path.join(app.config['UPLOAD_FOLDER'], f"{upload_id}.upload")
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, total_size)
+            else:
+                os.ftruncate(fd, total_size)
+        except OSError as e:
+            os.close(fd)
+            os.remove(target)
+            return jsonify({"error": f"Cannot allocate {total_size} bytes: {e}"}), 507
+        os.close(fd)
+        session.update(target=target, total_size=total_size, chunk_size=chunk_size,
+                       chunk_count=math.ceil(total_size / chunk_size), received=set(),
+                       early_start=EARLY_START, early_lock=threading.Lock(), job_id=None, tracks=None,
+                       settings=upload_job_settings(request.form), complete=False, failed=False, content_hash=None)
+    else:
+        os.makedirs(os.path.join(app.config['CHUNKS_FOLDER'], upload_id), exist_ok=True)
+    
+    with upload_sessions_lock:
+        upload_sessions[upload_id] = session
+    return jsonify({"upload_id": upload_id, "chunk_size": chunk_size if total_size > 0 else None})
+
+# Delete what an upload has written so far. A preallocated target that an early job
+# started on belongs to the job, which removes it when it ends.
+def remove_upload_files(upload_id, session):
+    if session and session['target']:
+        if not session['job_id'] and os.path.exists(session['target']):
+            os.remove(session['target'])
+    else:
+        shutil.rmtree(os.path.join(app.config['CHUNKS_FOLDER'], secure_filename(upload_id)), ignore_errors=True)
+
+# Drop sessions no chunk has reached for UPLOAD_SESSION_TTL, with their partial files,
+# and chunk folders left behind by sessions lost to a restart. A session whose early
+# job is still running is left alone: the job fails on its own once the upload stalls.
+def expire_upload_sessions():
+    now = time.time()
+    with upload_sessions_lock:
+        stale = {upload_id: session for upload_id, session in upload_sessions.items()
+                 if now - session['touched'] > UPLOAD_SESSION_TTL
+                 and not (session['target'] and session['job_id'] and not session['failed'])}
+        for upload_id in stale:
+            upload_sessions.pop(upload_id)
+        live = set(upload_sessions)
+    
+    for upload_id, session in stale.items():
+        remove_upload_files(upload_id, session)
+    for name in os.listdir(app.config['CHUNKS_FOLDER']):
+        upload_dir = os.path.join(app.config['CHUNKS_FOLDER'], name)
+        if name not in live and now - os.path.getmtime(upload_dir) > UPLOAD_SESSION_TTL:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+# Bytes of chunk i, or None if it hasn't arrived
+def read_upload_chunk(session, upload_dir, chunk_index):
+    if session['target']:
+        if chunk_index not in session['received']:
+            return None
+        length = min(session['chunk_size'], session['total_size'] - chunk_index * session['chunk_size'])
+        fd = os.open(session['target'], os.O_RDONLY)
+        try:
+            return os.pread(fd, length, chunk_index * session['chunk_size'])
+        finally:
+            os.close(fd)
+    chunk_file = os.path.join(upload_dir, f"chunk_{chunk_index}")
+    if not os.path.exists(chunk_file):
+        return None
+    with open(chunk_file, 'rb') as f:
+        return f.read()
+
+# Feed the session digest every chunk that is now contiguous with what it has seen.
+# The chunk that just arrived is hashed from memory; chunks that came early are read
+# back from disk once the gap before them closes. Keeping a plain SHA-256 of the
+# file (rather than a tree hash) makes the key match file_digest and the part cache.
+def advance_upload_digest(session, upload_dir, chunk_index=None, data=None):
+    with session['lock']:
+        if chunk_index == session['next_chunk']:
+            session['digest'].update(data)
+            session['next_chunk'] += 1
+        while True:
+            data = read_upload_chunk(session, upload_dir, session['next_chunk'])
+            if data is None:
+                break
+            session['digest'].update(data)
+            session['next_chunk'] += 1
+
+# True once every chunk overlapping bytes [start, end) of the target has arrived
+def upload_has_range(session, start, end):
+    if start is None or end <= start:
+        return True
+    chunk_size = session['chunk_size']
+    with session['lock']:
+        return all(i in session['received'] for i in range(start // chunk_size, (end - 1) // chunk_size + 1))
+
+# Bytes of the target, or None until they have all arrived
+def read_upload_range(session, offset, length):
+    if offset + length > session['total_size'] or not upload_has_range(session, offset, offset + length):
+        return None
+    fd = os.open(session['target'], os.O_RDONLY)
+    try:
+        return os.pread(fd, length, offset)
+    finally:
+        os.close(fd)
+
+# Start the job before the upload finishes once the moov (and so the sample table)
+# of a faststart MP4 is in. process_video then encodes each part as soon as the
+# chunks holding its samples arrive. Anything else waits for complete_upload.
+def maybe_start_early_job(session):
+    if not session['early_start'] or session['job_id'] or not session['early_lock'].acquire(blocking=False):
+        return
+    try:
+        # complete_upload clears early_start under the lock once it takes over
+        if not session['early_start'] or session['job_id']:
+            return
+        try:
+            moov = read_moov(functools.partial(read_upload_range, session), session['total_size'])
+            if moov is None:
+                return
+            tracks = parse_moov(moov)
+        except (NotFaststart, ValueError):
+            session['early_start'] = False
+            return
+        if not any(track['handler'] == 'vide' and track['times'] for track in tracks):
+            session['early_start'] = False
+            return
+        
+        session['tracks'] = tracks
+        session['job_id'] = str(int(time.time()))
+        profile, deadline, output_layouts = session['settings']
+        asyncio.run_coroutine_threadsafe(process_video(session['target'], session['job_id'], current_part_duration,
+                                                       current_processing_mode, current_show_label,
+                                                       current_encoder_preference, profile, deadline,
+                                                       output_layouts, upload=session),
+                                         bot_event_loop)
+    finally:
+        session['early_lock'].release()
+
+# Positional write of one chunk (or the piece of it at within) into the preallocated target
+def write_upload_chunk(session, chunk_index, data, within=0):
+    offset = chunk_index * session['chunk_size'] + within
+    fd = os.open(session['target'], os.O_WRONLY)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    finally:
+        os.close(fd)
+
+# Session, chunk folder, parsed index and expected size of one chunk, or an (error,
+# status) pair, for both the Flask and the streaming chunk routes. Every chunk of a
+# preallocated upload but the last is exactly chunk_size, so its offset is fixed;
+# per-chunk-file uploads take any size up to MAX_CONTENT_LENGTH (expected is None).
+def check_upload_chunk(upload_id, chunk_index):
+    try:
+        chunk_index = int(chunk_index)
+    except (TypeError, ValueError):
+        return None, None, None, None, ("Invalid chunk_index", 400)
+    upload_id = upload_id or ''
+    upload_dir = os.path.join(app.config['CHUNKS_FOLDER'], secure_filename(upload_id))
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+    if session:
+        session['touched'] = time.time()
+    
+    if session and session['target']:
+        if session['failed']:
+            return None, None, None, None, ("Processing this upload failed", 410)
+        if not 0 <= chunk_index < session['chunk_count']:
+            return None, None, None, None, (f"Chunk {chunk_index} has the wrong index or size", 400)
+        expected = min(session['chunk_size'], session['total_size'] - chunk_index * session['chunk_size'])
+        return session, upload_dir, chunk_index, expected, None
+    if not upload_id or not os.path.isdir(upload_dir):
+        return None, None, None, None, ("Unknown upload ID", 404)
+    if chunk_index < 0:
+        return None, None, None, None, ("Invalid chunk_index", 400)
+    return session, upload_dir, chunk_index, None, None
 
 @app.route('/upload_chunk', methods=['POST'])
 def upload_chunk():
     if not bot_ready:
         return jsonify({"error": "Bot not ready"}), 503
     
-    upload_id = request.form.get('upload_id')
-    chunk_index = request.form.get('chunk_index')
-    chunk_file = os.path.join(app.config['CHUNKS_FOLDER'], upload_id, f"chunk_{chunk_index}")
-    request.files.get('chunk').save(chunk_file)
+    session, upload_dir, chunk_index, expected, error = check_upload_chunk(request.form.get('upload_id'),
+                                                                           request.form.get('chunk_index'))
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+    if 'chunk' not in request.files:
+        return jsonify({"error": "Missing chunk"}), 400
+    data = request.files['chunk'].read()
+    
+    if session and session['target']:
+        if len(data) != expected:
+            return jsonify({"error": f"Chunk {chunk_index} has the wrong index or size"}), 400
+        write_upload_chunk(session, chunk_index, data)
+        with session['lock']:
+            session['received'].add(chunk_index)
+        maybe_start_early_job(session)
+    else:
+        # Written under a temporary name so the digest never reads a partial chunk
+        chunk_file = os.path.join(upload_dir, f"chunk_{chunk_index}")
+        with open(f"{chunk_file}.part", 'wb') as f:
+            f.write(data)
+        os.replace(f"{chunk_file}.part", chunk_file)
+    
+    if session:
+        advance_upload_digest(session, upload_dir, chunk_index, data)
+    return jsonify({"success": True})
+
+# Session and byte range of a raw PUT to a preallocated upload, or an (error, status)
+# pair. Ranges start on a chunk boundary and end on one or at the end of the file,
+# so every chunk they cover is written whole by the one request.
+def check_upload_range(upload_id, content_range, content_length):
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+    if not session or not session['target']:
+        return None, None, None, ("Unknown upload ID, or not a preallocated upload", 404)
+    if session['failed']:
+        return None, None, None, ("Processing this upload failed", 410)
+    if content_length is None:
+        return None, None, None, ("Content-Length required", 411)
+    
+    # Content-Range: bytes start-end/total, end inclusive
+    unit, _, spec = (content_range or '').partition(' ')
+    span, _, total = spec.partition('/')
+    start, _, end = span.partition('-')
+    try:
+        start, end, total = int(start), int(end), int(total)
+    except ValueError:
+        return None, None, None, ("Content-Range must be 'bytes start-end/total'", 400)
+    chunk_size = session['chunk_size']
+    if unit != 'bytes' or total != session['total_size'] or not 0 <= start <= end < total:
+        return None, None, None, (f"Range does not fit the {session['total_size']} byte upload", 416)
+    if start % chunk_size or ((end + 1) % chunk_size and end + 1 != total):
+        return None, None, None, (f"Range must start and end on {chunk_size} byte chunk boundaries", 416)
+    if content_length != end + 1 - start:
+        return None, None, None, ("Content-Length does not match Content-Range", 400)
+    return session, start, end, None
+
+# Write part of a range body at position. Chunks whose last byte this block writes
+# are complete, so they are marked received (feeding the digest and early start)
+# while a large PUT is still streaming
+def receive_upload_bytes(session, position, block):
+    session['touched'] = time.time()
+    chunk_size = session['chunk_size']
+    write_upload_chunk(session, position // chunk_size, block, position % chunk_size)
+    end = position + len(block)
+    completed = [i for i in range(position // chunk_size, min(end // chunk_size + 1, session['chunk_count']))
+                 if position < min((i + 1) * chunk_size, session['total_size']) <= end]
+    if completed:
+        with session['lock']:
+            session['received'].update(completed)
+        maybe_start_early_job(session)
+        advance_upload_digest(session, None)
+
+# Raw byte-range upload for curl and scripted clients, no multipart parsing:
+#   curl -T video.mp4 -H "Content-Range: bytes 0-$((size-1))/$size" http://host:5000/upload/<upload_id>
+# after POSTing total_size to /init_upload, then finish with /complete_upload.
+# The body is read straight from the WSGI input, so MAX_CONTENT_LENGTH doesn't apply.
+@app.route('/upload/<upload_id>', methods=['PUT'])
+def upload_range(upload_id):
+    if not bot_ready:
+        return jsonify({"error": "Bot not ready"}), 503
+    session, start, end, error = check_upload_range(upload_id, request.headers.get('Content-Range'),
+                                                    request.content_length)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+    
+    stream = request.environ['wsgi.input']
+    position = start
+    while position <= end:
+        block = stream.read(min(STREAM_BLOCK_SIZE, end + 1 - position))
+        if not block:
+            break
+        receive_upload_bytes(session, position, block)
+        position += len(block)
+    if position != end + 1:
+        return jsonify({"error": f"Body ended at byte {position}", "received": sorted(session['received'])}), 400
+    return jsonify({"success": True, "received": len(session['received']), "chunk_count": session['chunk_count']})
+
+# Chunks the server already has, so a client can resume and send only the rest
+@app.route('/upload_status')
+def upload_status():
+    upload_id = request.args.get('upload_id', '')
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+    
+    if session and session['target']:
+        # The early-started job failed and deleted the file: nothing left to resume
+        if session['failed']:
+            return jsonify({"error": "Processing this upload failed"}), 410
+        with session['lock']:
+            received = sorted(session['received'])
+        return jsonify({"upload_id": upload_id, "chunk_size": session['chunk_size'],
+                        "chunk_count": session['chunk_count'], "received": received})
+    
+    upload_dir = os.path.join(app.config['CHUNKS_FOLDER'], secure_filename(upload_id))
+    if not upload_id or not os.path.isdir(upload_dir):
+        return jsonify({"error": "Unknown upload ID"}), 404
+    received = sorted(int(name.split('_')[1]) for name in os.listdir(upload_dir)
+                      if name.startswith('chunk_') and not name.endswith('.part'))
+    return jsonify({"upload_id": upload_id, "received": received})
+
+# Abandon an upload: its session and whatever it has written so far are removed
+@app.route('/cancel_upload', methods=['POST'])
+def cancel_upload():
+    upload_id = request.form.get('upload_id', '')
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+        if session and session['target'] and session['job_id'] and not session['failed']:
+            return jsonify({"error": "Processing already under way", "job_id": session['job_id']}), 409
+        upload_sessions.pop(upload_id, None)
+    if not session and not (upload_id and os.path.isdir(os.path.join(app.config['CHUNKS_FOLDER'],
+                                                                     secure_filename(upload_id)))):
+        return jsonify({"error": "Unknown upload ID"}), 404
+    remove_upload_files(upload_id, session)
     return jsonify({"success": True})
 
+# Append a chunk file to the open output with in-kernel copies: copy_file_range (which
+# can share extents on reflink filesystems), else sendfile. Filesystems or kernels that
+# refuse both (with an error, or by copying nothing) fall back to a buffered copy from
+# wherever the kernel copy stopped.
+def append_chunk(outfile, chunk_path):
+    with open(chunk_path, 'rb') as infile:
+        remaining = os.fstat(infile.fileno()).st_size
+        try:
+            while remaining > 0:
+                if hasattr(os, 'copy_file_range'):
+                    copied = os.copy_file_range(infile.fileno(), outfile.fileno(), remaining)
+                else:
+                    copied = os.sendfile(outfile.fileno(), infile.fileno(), None, remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            pass
+        if remaining > 0:
+            shutil.copyfileobj(infile, outfile, 1024 * 1024)
+            outfile.flush()
+
 @app.route('/complete_upload', methods=['POST'])
 def complete_upload():
     if not bot_ready:
@@ -264,22 +1246,135 @@ def complete_upload():
     upload_id = request.form.get('upload_id')
     file_name = request.form.get('file_name')
     upload_dir = os.path.join(app.config['CHUNKS_FOLDER'], upload_id)
+    profile, deadline, output_layouts = upload_job_settings(request.form)
     
-    # Combine chunks
+    # The content hash is ready as soon as the last chunk is in; sessions lost to a
+    # restart leave it to process_video to hash the assembled file
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+    content_hash = None
     video_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file_name))
-    with open(video_path, 'wb') as outfile:
-        for chunk_file in sorted(os.listdir(upload_dir), key=lambda x: int(x.split('_')[1])):
-            with open(os.path.join(upload_dir, chunk_file), 'rb') as infile:
-                outfile.write(infile.read())
     
-    shutil.rmtree(upload_dir)
+    if session and session['target']:
+        # Chunks were written in place, so completion is a rename
+        missing = sorted(set(range(session['chunk_count'])) - session['received'])
+        if missing:
+            return jsonify({"error": "Upload incomplete", "missing_chunks": missing}), 400
+        advance_upload_digest(session, upload_dir)
+        content_hash = session['digest'].hexdigest()
+        
+        # The job started early is reading the target in place; it only needs the hash.
+        # Holding the early-start lock settles a start racing with this request
+        with session['early_lock']:
+            session['early_start'] = False
+        if session['job_id']:
+            session['content_hash'] = content_hash
+            session['complete'] = True
+            with upload_sessions_lock:
+                upload_sessions.pop(upload_id, None)
+            return jsonify({"success": True, "message": "Video uploaded, processing already under way.",
+                            "job_id": session['job_id']})
+        os.replace(session['target'], video_path)
+    else:
+        if session:
+            advance_upload_digest(session, upload_dir)
+            chunk_count = len([name for name in os.listdir(upload_dir) if name.startswith('chunk_') and not name.endswith('.part')])
+            if session['next_chunk'] == chunk_count:
+                content_hash = session['digest'].hexdigest()
+        
+        # Combine chunks
+        with open(video_path, 'wb') as outfile:
+            for chunk_file in sorted((name for name in os.listdir(upload_dir) if not name.endswith('.part')),
+                                    key=lambda x: int(x.split('_')[1])):
+                append_chunk(outfile, os.path.join(upload_dir, chunk_file))
+        
+        shutil.rmtree(upload_dir)
+    
+    with upload_sessions_lock:
+        upload_sessions.pop(upload_id, None)
     
     # Generate job ID and start processing
     job_id = str(int(time.time()))
-    asyncio.run_coroutine_threadsafe(process_video(video_path, job_id, current_part_duration), bot_event_loop)
+    asyncio.run_coroutine_threadsafe(process_video(video_path, job_id, current_part_duration, current_processing_mode,
+                                                   current_show_label, current_encoder_preference, profile,
+                                                   deadline, output_layouts, content_hash),
+                                     bot_event_loop)
     
     return jsonify({"success": True, "message": "Video uploaded and processing started.", "job_id": job_id})
 
+# Async server routes: upload chunks are streamed to disk a block at a time rather
+# than buffered whole; status polls and webhooks are answered on the server loop
+async def upload_chunk_streamed(request):
+    if not bot_ready:
+        return web.json_response({"error": "Bot not ready"}, status=503)
+    if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+        return web.json_response({"error": "Chunk too large"}, status=413)
+    
+    fields = {}
+    reader = await request.multipart()
+    async for part in reader:
+        if part.name != 'chunk':
+            fields[part.name] = await part.text()
+            continue
+        
+        # The form sends upload_id and chunk_index ahead of the chunk itself
+        session, upload_dir, chunk_index, expected, error = check_upload_chunk(fields.get('upload_id'),
+                                                                               fields.get('chunk_index'))
+        if error:
+            return web.json_response({"error": error[0]}, status=error[1])
+        
+        if session and session['target']:
+            # The size is only known once the chunk has streamed in
+            size = await stream_part(part, functools.partial(write_upload_chunk, session, chunk_index), expected)
+            if size != expected:
+                return web.json_response({"error": f"Chunk {chunk_index} has the wrong index or size"}, status=400)
+            with session['lock']:
+                session['received'].add(chunk_index)
+            await asyncio.to_thread(maybe_start_early_job, session)
+        else:
+            chunk_file = os.path.join(upload_dir, f"chunk_{chunk_index}")
+            with open(f"{chunk_file}.part", 'wb') as f:
+                size = await stream_part(part, lambda block, within: f.write(block), app.config['MAX_CONTENT_LENGTH'])
+            if size > app.config['MAX_CONTENT_LENGTH']:
+                os.remove(f"{chunk_file}.part")
+                return web.json_response({"error": "Chunk too large"}, status=413)
+            os.replace(f"{chunk_file}.part", chunk_file)
+        
+        if session:
+            await asyncio.to_thread(advance_upload_digest, session, upload_dir)
+        return web.json_response({"success": True})
+    return web.json_response({"error": "Missing chunk"}, status=400)
+
+async def upload_range_streamed(request):
+    if not bot_ready:
+        return web.json_response({"error": "Bot not ready"}, status=503)
+    session, start, end, error = check_upload_range(request.match_info['upload_id'],
+                                                    request.headers.get('Content-Range'), request.content_length)
+    if error:
+        return web.json_response({"error": error[0]}, status=error[1])
+    
+    size = await stream_body(request, lambda block, within: receive_upload_bytes(session, start + within, block))
+    if size != end + 1 - start:
+        return web.json_response({"error": f"Body ended at byte {start + size}",
+                                  "received": sorted(session['received'])}, status=400)
+    return web.json_response({"success": True, "received": len(session['received']),
+                              "chunk_count": session['chunk_count']})
+
+async def job_status_async(request):
+    job_id = request.query.get('job_id')
+    if not job_id:
+        return web.json_response({"error": "Missing job_id"}, status=400)
+    with job_status_lock:
+        status = job_status.get(job_id, {"status": "unknown", "message": "Job not found"})
+    return web.json_response(status)
+
+async def webhook_async(request):
+    if request.content_type == 'application/json':
+        update = telebot.types.Update.de_json(await request.text())
+        asyncio.run_coroutine_threadsafe(bot.process_new_updates([update]), bot_event_loop)
+        return web.json_response({"status": "ok"})
+    return web.json_response({"status": "error"})
+
 # Create enhanced template
 os.makedirs('templates', exist_ok=True)
 with open('templates/index.html', 'w') as f:
@@ -398,7 +1493,11 @@ with open('templates/index.html', 'w') as f:
             color: #555;
             font-weight: 600;
         }
-        .form-group input {
+        .form-group input[type="checkbox"] {
+            width: auto;
+            margin-right: 5px;
+        }
+        .form-group input, .form-group select {
             width: 100%;
             padding: 10px;
             border: 1px solid #ddd;
@@ -611,6 +1710,32 @@ with open('templates/index.html', 'w') as f:
                 <label for="part-duration">Part Duration (seconds):</label>
                 <input type="number" id="part-duration" min="1" value="15">
             </div>
+            <div class="form-group">
+                <label for="processing-mode">Processing Mode:</label>
+                <select id="processing-mode">
+                    <option value="segment">Single pass (fast)</option>
+                    <option value="per_part">One encode per part</option>
+                    <option value="copy">Stream copy (no re-encode)</option>
+                    <option value="smart">Frame-accurate trim (no label)</option>
+                </select>
+            </div>
+            <div class="form-group">
+                <label for="encoding-profile">Encoding Profile:</label>
+                <select id="encoding-profile"></select>
+            </div>
+            <div class="form-group">
+                <label for="deadline">Delivery Deadline (seconds, 0 = none):</label>
+                <input type="number" id="deadline" min="0" value="0">
+            </div>
+            <div class="form-group">
+                <label>Output Formats:</label>
+                <div id="output-layouts"></div>
+            </div>
+            <div class="form-group">
+                <label for="show-label">
+                    <input type="checkbox" id="show-label" checked> Show "Part N" label
+                </label>
+            </div>
             <button id="save-settings">Save Settings</button>
         </div>
         
@@ -679,6 +1804,11 @@ with open('templates/index.html', 'w') as f:
             const saveSettingsBtn = document.getElementById('save-settings');
             const chatIdInput = document.getElementById('chat-id');
             const partDurationInput = document.getElementById('part-duration');
+            const processingModeSelect = document.getElementById('processing-mode');
+            const showLabelCheckbox = document.getElementById('show-label');
+            const encodingProfileSelect = document.getElementById('encoding-profile');
+            const deadlineInput = document.getElementById('deadline');
+            const outputLayoutsDiv = document.getElementById('output-layouts');
             const currentDurationSpan = document.getElementById('current-duration');
             const statusIndicator = document.getElementById('status-indicator');
             const statusText = document.getElementById('status-text');
@@ -705,6 +1835,34 @@ with open('templates/index.html', 'w') as f:
                         // Update current settings
                         chatIdInput.value = data.chat_id;
                         partDurationInput.value = data.part_duration;
+                        processingModeSelect.value = data.processing_mode;
+                        showLabelCheckbox.checked = data.show_label;
+                        
+                        // Profiles with their measured speed on this host
+                        if (encodingProfileSelect.options.length === 0) {
+                            Object.entries(data.profiles).forEach(([name, info]) => {
+                                const speeds = Object.entries(info.measured)
+                                    .map(([encoder, m]) => `${encoder} ${m.fps.toFixed(0)} fps, ${(m.bytes_per_second / 1048576).toFixed(1)} MB/s`);
+                                const option = document.createElement('option');
+                                option.value = name;
+                                option.textContent = `${name} - ${info.description}` + (speeds.length ? ` (${speeds.join('; ')})` : '');
+                                encodingProfileSelect.appendChild(option);
+                            });
+                        }
+                        encodingProfileSelect.value = data.profile;
+                        deadlineInput.value = data.deadline || 0;
+                        
+                        // One checkbox per layout; all checked ones come from a single decode
+                        if (outputLayoutsDiv.children.length === 0) {
+                            Object.entries(data.available_layouts).forEach(([name, size]) => {
+                                const label = document.createElement('label');
+                                label.innerHTML = `<input type="checkbox" value="${name}"> ${name} (${size})`;
+                                outputLayoutsDiv.appendChild(label);
+                            });
+                        }
+                        outputLayoutsDiv.querySelectorAll('input').forEach(input => {
+                            input.checked = data.output_layouts.includes(input.value);
+                        });
                         currentDurationSpan.textContent = `${data.part_duration} seconds`;
                     })
                     .catch(error => {
@@ -730,7 +1888,12 @@ with open('templates/index.html', 'w') as f:
             saveSettingsBtn.addEventListener('click', () => {
                 const settings = {
                     chat_id: chatIdInput.value,
-                    part_duration: partDurationInput.value
+                    part_duration: partDurationInput.value,
+                    processing_mode: processingModeSelect.value,
+                    show_label: showLabelCheckbox.checked,
+                    profile: encodingProfileSelect.value,
+                    deadline: deadlineInput.value,
+                    output_layouts: Array.from(outputLayoutsDiv.querySelectorAll('input:checked')).map(input => input.value)
                 };
                 
                 fetch('/update_settings', {
@@ -846,6 +2009,9 @@ with open('templates/index.html', 'w') as f:
                 }, 2000);
             }
             
+            const PARALLEL_UPLOADS = 4;
+            const MAX_CHUNK_ATTEMPTS = 5;
+            
             async function uploadFile(file) {
                 const chunkSize = 5 * 1024 * 1024; // 5MB chunks
                 const totalChunks = Math.ceil(file.size / chunkSize);
@@ -855,59 +2021,119 @@ with open('templates/index.html', 'w') as f:
                 statusDiv.style.display = 'none';
                 processingStatus.style.display = 'none';
                 
+                // Resume an interrupted upload of the same file, else start a new one
+                const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
                 try {
-                    // Initialize upload
-                    const initResponse = await fetch('/init_upload', { method: 'POST' });
-                    const initData = await initResponse.json();
-                    
-                    if (initData.error) {
-                        throw new Error(initData.error);
+                    let uploadId = localStorage.getItem(resumeKey);
+                    let received = new Set();
+                    if (uploadId) {
+                        const statusResponse = await fetch(`/upload_status?upload_id=${encodeURIComponent(uploadId)}`);
+                        if (statusResponse.ok) {
+                            received = new Set((await statusResponse.json()).received);
+                        } else {
+                            uploadId = null;
+                        }
                     }
                     
-                    const uploadId = initData.upload_id;
+                    if (!uploadId) {
+                        // The server preallocates the file and writes each chunk
+                        // at chunkIndex * chunkSize
+                        const initFormData = new FormData();
+                        initFormData.append('total_size', file.size);
+                        initFormData.append('chunk_size', chunkSize);
+                        const initResponse = await fetch('/init_upload', { method: 'POST', body: initFormData });
+                        const initData = await initResponse.json();
+                        
+                        if (initData.error) {
+                            throw new Error(initData.error);
+                        }
+                        
+                        uploadId = initData.upload_id;
+                        localStorage.setItem(resumeKey, uploadId);
+                    }
                     
-                    // Upload chunks
+                    // Upload the missing chunks, PARALLEL_UPLOADS at a time
+                    const pending = [];
                     for (let chunkIndex = 0; chunkIndex < totalChunks; chunkIndex++) {
+                        if (!received.has(chunkIndex)) {
+                            pending.push(chunkIndex);
+                        }
+                    }
+                    let uploaded = totalChunks - pending.length;
+                    
+                    // A failed chunk is retried with backoff instead of restarting the upload
+                    async function uploadChunk(chunkIndex) {
                         const start = chunkIndex * chunkSize;
-                        const end = Math.min(file.size, start + chunkSize);
-                        const chunk = file.slice(start, end);
-                        
-                        const formData = new FormData();
-                        formData.append('upload_id', uploadId);
-                        formData.append('chunk_index', chunkIndex);
-                        formData.append('chunk', chunk);
-                        
-                        const progress = Math.round(((chunkIndex + 1) / totalChunks) * 100);
-                        progressBar.style.width = progress + '%';
-                        progressText.textContent = progress + '%';
-                        
-                        const response = await fetch('/upload_chunk', {
-                            method: 'POST',
-                            body: formData
-                        });
-                        
-                        const data = await response.json();
-                        
-                        if (data.error) {
-                            throw new Error(data.error);
+                        const chunk = file.slice(start, Math.min(file.size, start + chunkSize));
+                        for (let attempt = 1; ; attempt++) {
+                            try {
+                                const formData = new FormData();
+                                formData.append('upload_id', uploadId);
+                                formData.append('chunk_index', chunkIndex);
+                                formData.append('chunk', chunk);
+                                
+                                const response = await fetch('/upload_chunk', {
+                                    method: 'POST',
+                                    body: formData
+                                });
+                                const data = await response.json();
+                                
+                                if (data.error) {
+                                    throw new Error(data.error);
+                                }
+                                return;
+                            } catch (error) {
+                                if (attempt >= MAX_CHUNK_ATTEMPTS) {
+                                    throw error;
+                                }
+                                await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+                            }
+                        }
+                    }
+                    
+                    async function uploadWorker() {
+                        while (pending.length > 0) {
+                            await uploadChunk(pending.shift());
+                            uploaded++;
+                            const progress = Math.round((uploaded / totalChunks) * 100);
+                            progressBar.style.width = progress + '%';
+                            progressText.textContent = progress + '%';
                         }
                     }
                     
+                    async function uploadPending() {
+                        await Promise.all(Array.from({ length: PARALLEL_UPLOADS }, uploadWorker));
+                    }
+                    
+                    await uploadPending();
+                    
                     // Complete upload
                     const completeFormData = new FormData();
                     completeFormData.append('upload_id', uploadId);
                     completeFormData.append('file_name', file.name);
                     
-                    const completeResponse = await fetch('/complete_upload', {
+                    let completeResponse = await fetch('/complete_upload', {
                         method: 'POST',
                         body: completeFormData
                     });
+                    let completeData = await completeResponse.json();
                     
-                    const completeData = await completeResponse.json();
+                    // The server lists chunks it never received; send those and finish again
+                    if (completeData.missing_chunks) {
+                        pending.push(...completeData.missing_chunks);
+                        uploaded -= completeData.missing_chunks.length;
+                        await uploadPending();
+                        completeResponse = await fetch('/complete_upload', {
+                            method: 'POST',
+                            body: completeFormData
+                        });
+                        completeData = await completeResponse.json();
+                    }
                     
                     if (completeData.error) {
                         throw new Error(completeData.error);
                     }
+                    localStorage.removeItem(resumeKey);
                     
                     // Start polling job status
                     if (completeData.job_id) {
@@ -918,6 +2144,8 @@ with open('templates/index.html', 'w') as f:
                     }
                     
                 } catch (error) {
+                    // A failed upload is not resumed; selecting the file again starts over
+                    localStorage.removeItem(resumeKey);
                     showStatus('Error: ' + error.message, false);
                     resetUpload();
                 }
@@ -956,4 +2184,13 @@ if __name__ == '__main__':
     else:
         print("Warning: WEBHOOK_URL environment variable not set.")
     
-    app.run(debug=False, host='0.0.0.0', port=5000)
+    if SERVER_MODE == 'async':
+        # Every other route is served by the Flask app in worker threads
+        run_async_server([
+            ('POST', '/upload_chunk', upload_chunk_streamed),
+            ('PUT', '/upload/{upload_id}', upload_range_streamed),
+            ('GET', '/job_status', job_status_async),
+            ('POST', '/webhook', webhook_async)
+        ], app, app.config['MAX_CONTENT_LENGTH'])
+    else:
+        app.run(debug=False, host='0.0.0.0', port=5000)
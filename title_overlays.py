@@ -0,0 +1,96 @@
+import os
+import hashlib
+import threading
+import subprocess
+
+# Rendered title frames are shared by every job that uses the same style
+OVERLAY_CACHE_DIR = os.environ.get('OVERLAY_CACHE_DIR', 'overlay_cache')
+
+# Colour schemes used by the scripts: bar colour, text colour, shadow colour, shadow offset
+OVERLAY_STYLES = {
+    'dark': ('black', 'white', 'black', 4),
+    'light': ('white', 'black', 'gray', 3),
+    'dark_glow': ('black', 'white', 'white', 3)  # The web bots' original drawtext look
+}
+
+_render_lock = threading.Lock()
+
+# The full 1080x1920 frame (bars plus label) rendered once as a PNG; its top bar is
+# later overlaid on the padded video instead of running drawtext on every frame
+def render_title_frame(label, font_path, width=1080, height=1920, style='dark', fontsize=80):
+    bar_color, text_color, shadow_color, shadow_offset = OVERLAY_STYLES[style]
+    key = hashlib.sha1(f"{label}|{font_path}|{width}x{height}|{style}|{fontsize}".encode()).hexdigest()
+    frame_path = os.path.join(OVERLAY_CACHE_DIR, f"{key}.png")
+    if os.path.exists(frame_path):
+        return frame_path
+
+    with _render_lock:
+        if not os.path.exists(frame_path):
+            os.makedirs(OVERLAY_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{frame_path}.tmp.png"
+            cmd = [
+                'ffmpeg', '-f', 'lavfi', '-i', f'color=c={bar_color}:s={width}x{height}',
+                '-vf', f'drawtext=text=\'{label}\':fontfile={font_path}:fontsize={fontsize}:'
+                       f'x=(w-tw)/2:y=(h-th)/10:fontcolor={text_color}:shadowcolor={shadow_color}:'
+                       f'shadowx={shadow_offset}:shadowy={shadow_offset}',
+                '-frames:v', '1', '-y', tmp_path
+            ]
+            subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            os.replace(tmp_path, frame_path)
+    return frame_path
+
+# Concat-demuxer list that shows each part's title frame for its time range, so a
+# single-pass encode can switch labels by timestamp
+def write_title_sequence(list_path, frame_paths, part_duration):
+    with open(list_path, 'w') as f:
+        for frame_path in frame_paths:
+            f.write(f"file '{os.path.abspath(frame_path)}'\nduration {part_duration}\n")
+        # The concat demuxer ignores the last entry's duration unless it is repeated
+        if frame_paths:
+            f.write(f"file '{os.path.abspath(frame_paths[-1])}'\n")
+    return list_path
+
+# Scale the video into the middle band, pad it out to the full frame in the bar colour
+# and overlay the top bar of the title frame (input 1), which holds the label. The
+# source is the overlay's main input, so its timestamps drive the output and VFR
+# sources keep their timing instead of being resampled to a fixed rate.
+def build_overlay_filter(target_width, top_bar_height, middle_height, style='dark'):
+    return ';'.join(_overlay_branch('[0:v]', '[1:v]', '[v]', target_width, top_bar_height, middle_height, style))
+
+def _overlay_branch(source, title, output, width, top_bar_height, middle_height, style):
+    height = middle_height + 2 * top_bar_height
+    bar_color = OVERLAY_STYLES[style][0]
+    label = output.strip('[]')
+    return [
+        f'{source}scale={width}:{middle_height}:force_original_aspect_ratio=decrease,'
+        f'pad={width}:{height}:(ow-iw)/2:{top_bar_height}+({middle_height}-ih)/2:color={bar_color}[fg_{label}]',
+        f'{title}crop={width}:{top_bar_height}:0:0,format=yuv420p[bar_{label}]',
+        f'[fg_{label}][bar_{label}]overlay=0:0{output}'
+    ]
+
+# Output layouts a job can request; each gets 20% bars above and below the video
+OUTPUT_LAYOUTS = {
+    'vertical': (1080, 1920),
+    'vertical_720p': (720, 1280),
+    'square': (1080, 1080),
+    'landscape': (1920, 1080)
+}
+
+def layout_bands(height):
+    top_bar_height = int(height * 0.2)
+    return top_bar_height, height - 2 * top_bar_height
+
+# Label size scaled from 80px on the 1920px-tall layout
+def layout_fontsize(height):
+    return max(24, round(80 * height / 1920))
+
+# One decode fanned out to several layouts: the source is split once and branch n gets
+# the title bar of input n+1, producing [v0], [v1], ... A title input that is a
+# concat sequence switches labels by timestamp, since the overlay shows its latest
+# frame at or before each source frame.
+def build_multi_overlay_filter(layouts, style='dark'):
+    graph = [f'[0:v]split={len(layouts)}' + ''.join(f'[src{n}]' for n in range(len(layouts)))]
+    for n, (width, height) in enumerate(layouts):
+        top_bar_height, middle_height = layout_bands(height)
+        graph += _overlay_branch(f'[src{n}]', f'[{n + 1}:v]', f'[v{n}]', width, top_bar_height, middle_height, style)
+    return ';'.join(graph)